@@ -11,10 +11,21 @@ APP_ENV = os.getenv("APP_ENV", "development")
 PROJECT = os.getenv("PROJECT")
 HOST_NAME = os.getenv("HOSTNAME", "localhost")
 NAMESPACE = os.getenv("NAMESPACE", "default")
+# namespace@context targets deployed together, comma separated within a wave and waves
+# separated by semicolons (staging@gke_staging;default@gke_us;default@gke_eu,default@gke_asia)
+DEPLOY_TARGETS = os.getenv("DEPLOY_TARGETS", "")
 
 # -------- Slack --------
 SLACK_TOKEN = os.getenv("SLACK_TOKEN")
 SLACK_CHANNEL = os.getenv("SLACK_CHANNEL", "dev-null")
+# max messages waiting for the background sender before send_thread_reply blocks
+SLACK_QUEUE_SIZE = int(os.getenv("SLACK_QUEUE_SIZE", 100))
+# thread replies queued within this window are posted as one message
+SLACK_COALESCE_SECONDS = float(os.getenv("SLACK_COALESCE_SECONDS", 1))
+# keep one edited status message for per-deployment progress instead of a reply per step
+SLACK_PROGRESS_BOARD = os.getenv("SLACK_PROGRESS_BOARD", False) in ["true", "True"]
+# min seconds between edits of the status message
+SLACK_BOARD_THROTTLE_SECONDS = float(os.getenv("SLACK_BOARD_THROTTLE_SECONDS", 5))
 
 # -------- Trello --------
 TRELLO_KEY = os.getenv("TRELLO_KEY")
@@ -34,6 +45,15 @@ MAILGUN_TO = os.getenv("MAILGUN_TO")
 DATABASE_INSTANCE_NAME = os.getenv("DATABASE_INSTANCE_NAME")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 DATABASE_BACKUP_BUCKET = f"{os.getenv('DATABASE_BACKUP_BUCKET')}/{DATABASE_NAME}"
+# sqladmin - export through the SQL Admin api, gcloud - export through the gcloud cli
+DATABASE_BACKUP_BACKEND = os.getenv("DATABASE_BACKUP_BACKEND", "sqladmin")
+# gcp project of the cloud sql instance, defaults to the project of the application credentials
+DATABASE_PROJECT = os.getenv("DATABASE_PROJECT")
+# SQL Admin api base url and bearer token, the token defaults to the application credentials
+SQL_ADMIN_URL = os.getenv("SQL_ADMIN_URL", "https://sqladmin.googleapis.com")
+SQL_ADMIN_TOKEN = os.getenv("SQL_ADMIN_TOKEN")
+# min seconds between backup progress updates in slack
+BACKUP_PROGRESS_SECONDS = float(os.getenv("BACKUP_PROGRESS_SECONDS", 60))
 
 # -------- Migrate job --------
 APP_MIGRATOR_SOURCE = os.getenv("APP_MIGRATOR_SOURCE")
@@ -43,6 +63,8 @@ APP_MIGRATOR_COMMAND = os.getenv("APP_MIGRATOR_COMMAND", "npm").split(",")
 APP_MIGRATOR_ARGS = os.getenv(
     "APP_MIGRATOR_ARGS", "run,--prefix,/app,migration:run"
 ).split(",")
+# trailing migration log lines kept for the slack snippet
+MIGRATION_LOG_LINES = int(os.getenv("MIGRATION_LOG_LINES", 200))
 
 # -------- Deployment Tiers --------
 # comma separated listed in scale down order
@@ -52,3 +74,73 @@ TIERS = os.getenv("TIERS", "frontend,scheduler,worker,gateway,apiserver").split(
 # worker - service queue workers
 # gateway - public facing api gateway
 # apiserver - service apiserver / internal gateway
+# comma separated list of tiers whose images are set without waiting for the migration
+MIGRATION_INDEPENDENT_TIERS = [
+    tier for tier in os.getenv("MIGRATION_INDEPENDENT_TIERS", "").split(",") if tier
+]
+
+# -------- Images --------
+# comma separated list of repositories retagged in every container and init container,
+# defaults to the repository of each object's first container
+IMAGE_REPOSITORIES = [
+    repository for repository in os.getenv("IMAGE_REPOSITORIES", "").split(",") if repository
+]
+# pin retagged images to the tag's manifest digest (repo:tag@sha256:...), resolved once per repository
+PIN_IMAGE_DIGESTS = os.getenv("PIN_IMAGE_DIGESTS", False) in ["true", "True"]
+# bearer token for the registry v2 api, gcr.io / pkg.dev fall back to application default credentials
+REGISTRY_TOKEN = os.getenv("REGISTRY_TOKEN")
+# credentials for the token endpoint of registries answering with a bearer challenge
+REGISTRY_USERNAME = os.getenv("REGISTRY_USERNAME")
+REGISTRY_PASSWORD = os.getenv("REGISTRY_PASSWORD")
+# comma separated list of registry hosts (localhost:5000) reached over plain http
+INSECURE_REGISTRIES = [
+    registry for registry in os.getenv("INSECURE_REGISTRIES", "").split(",") if registry
+]
+
+# check every release repository:tag exists in its registry before anything is changed
+PREFLIGHT_IMAGES = os.getenv("PREFLIGHT_IMAGES", False) in ["true", "True"]
+
+# -------- Image pre-pull --------
+# pull new images on every node through a short-lived DaemonSet before a cold scale down
+PREPULL_IMAGES = os.getenv("PREPULL_IMAGES", False) in ["true", "True"]
+# comma separated command the pre-pull containers idle with
+PREPULL_COMMAND = os.getenv("PREPULL_COMMAND", "sh,-c,sleep 3600").split(",")
+
+# -------- Journal --------
+# configmap - keep the deploy journal in a {PROJECT}-deploy-journal config map, file - in JOURNAL_PATH
+JOURNAL_BACKEND = os.getenv("JOURNAL_BACKEND", "configmap")
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "/tmp/deploy-journal.json")
+
+# -------- Report --------
+# json report of step timings, api call counts and sleep time written at the end of every run
+DEPLOY_REPORT_PATH = os.getenv("DEPLOY_REPORT_PATH", "/tmp/deploy-report.json")
+# openmetrics file written at the end of every run, empty to skip
+METRICS_PATH = os.getenv("METRICS_PATH", "/tmp/deploy-metrics.txt")
+# pushgateway base url (http://pushgateway:9091) the metrics are pushed to, empty to skip
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL")
+
+# -------- Rollout --------
+# max deployments patched and verified at the same time within a tier
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", 8))
+# rollout deadlines: at least MIN_ROLLOUT_TIMEOUT_SECONDS and progressDeadlineSeconds,
+# ROLLOUT_BATCH_SECONDS per maxSurge/maxUnavailable batch
+# and ROLLOUT_HISTORY_FACTOR times the last recorded rollout
+MIN_ROLLOUT_TIMEOUT_SECONDS = float(os.getenv("MIN_ROLLOUT_TIMEOUT_SECONDS", 120))
+ROLLOUT_BATCH_SECONDS = float(os.getenv("ROLLOUT_BATCH_SECONDS", 60))
+ROLLOUT_HISTORY_FACTOR = float(os.getenv("ROLLOUT_HISTORY_FACTOR", 2))
+# seconds on top of the pod termination grace period to wait for old pods to go away
+TERMINATION_MARGIN_SECONDS = float(os.getenv("TERMINATION_MARGIN_SECONDS", 60))
+
+# -------- Canary --------
+# comma separated list of tiers rolled out to CANARY_PODS new pods and baked before the rest
+CANARY_TIERS = [tier for tier in os.getenv("CANARY_TIERS", "").split(",") if tier]
+# new pods in the canary, a count (2) or a percentage of replicas (10%)
+CANARY_PODS = os.getenv("CANARY_PODS", "10%")
+# seconds the canary pods are watched before the rollout continues
+CANARY_BAKE_SECONDS = float(os.getenv("CANARY_BAKE_SECONDS", 120))
+# container restarts a canary pod may have during the bake
+CANARY_MAX_RESTARTS = int(os.getenv("CANARY_MAX_RESTARTS", 0))
+# optional health url requested during the bake, {deployment} is replaced by the deployment name
+CANARY_PROBE_URL = os.getenv("CANARY_PROBE_URL")
+# seconds between probe requests during the bake
+CANARY_PROBE_SECONDS = float(os.getenv("CANARY_PROBE_SECONDS", 10))
@@ -1,14 +1,46 @@
 import config
 import argparse
 import logging
-import subprocess
 import os
+import sys
+import time
 
 from datetime import datetime
-from lib.slackApi import SlackApi
-from lib.kubeApi import KubeApi
-from lib.helpers import generate_image
+from typing import List
+from lib.slackApi import SlackApi, TargetSlacker
+from lib.progressBoard import ProgressBoard, DONE, FAILED, PATCHED, PENDING, VERIFYING
+from lib.kubeApi import KubeApi, create_api_client
+from lib.canary import get_canary_pods, is_canary_deployment, probe_canary
+from lib.databaseBackup import get_backup_backend
+from lib.deployJournal import DeployJournal, get_journal_store
+from lib.deployPlan import build_plan, format_plan
+from lib.deployTargets import DeployTarget, parse_waves
+from lib.stepGraph import StepGraph
+from lib.inventory import Inventory
+from lib.metrics import export_metrics
+from lib.registry import find_missing_images
+from lib.helpers import run_concurrently
+from lib.imageMap import (
+    describe_image_changes,
+    describe_images,
+    get_changed_images,
+    get_release_tags,
+    has_images,
+    retag_images,
+)
+from lib.tracing import summarize_report, tracer
 from lib.trello import cleanup_trello
+from lib.waitPolicy import (
+    ROLLOUT_SECONDS_ANNOTATION,
+    get_rollout_timeout,
+    get_termination_timeout,
+)
+
+SCALE_DOWN_STAGE = "scale down"
+SCALE_UP_STAGE = "scale up"
+SET_IMAGE_STAGE = "image"
+CANARY_STAGE = "canary"
+ROLLBACK_STAGE = "rollback"
 
 logging.basicConfig(
     level=logging.DEBUG, format="[%(asctime)s][%(levelname)s] %(message)s"
@@ -20,30 +52,146 @@ class Deployorama:
     Perform kubernetes deployment and all that jazz.
     """
 
-    def __init__(self):
+    def __init__(self, target: DeployTarget = None, slacker: SlackApi = None):
         self.tag = config.TAG
         self.migration = config.MIGRATION_LEVEL
         self.check_cronjobs = config.CHECK_CRONJOBS
-        self.slacker = SlackApi()
-        self.kuber = KubeApi(namespace=config.NAMESPACE)
-        self.deployments = {
-            tier: self.kuber.get_deployments(
-                label_selector="project={}, tier={}".format(config.PROJECT, tier)
+        self.target = target
+        self.slacker = slacker if slacker is not None else SlackApi()
+        if target is None:
+            self.kuber = KubeApi(namespace=config.NAMESPACE)
+        else:
+            self.kuber = KubeApi(
+                namespace=target.namespace, api_client=create_api_client(target.context)
             )
-            for tier in config.TIERS
-        }
-        self.cronjobs = self.kuber.get_cronjobs(label_selector="project={}".format(config.PROJECT))
+        self.inventory = Inventory(self.kuber, project=config.PROJECT, tiers=config.TIERS)
+        self.deployments = self.inventory.get_deployments()
+        self.cronjobs = self.inventory.get_cronjobs()
         self.has_down_time = self.migration == 2
         self.has_migration = self.migration > 0
         self.migration_completed = False
+        self.migrator_job = None
         self.deploy_success = True
+        self.error_message = None
+        self.error_handling_message = None
+        self.board = None
+        self.journal = DeployJournal(
+            get_journal_store(self.kuber, target.slug if target is not None else None),
+            self.tag,
+            self.migration,
+        )
+        self.is_resumed = self.journal.load()
+        self.carried_over = []
+        if self.is_resumed:
+            self.journal.restore_deployments(self.all_deployments())
+            self.migration_completed = self.journal.is_completed("run_migration")
+        else:
+            self.carry_over_interrupted()
 
-    def get_new_image(self, image):
-        return generate_image(old_image=image, new_tag=self.tag)
+    def get_new_images(self, images: dict) -> dict:
+        return retag_images(images, new_tag=self.tag)
+
+    def skip_migration(self):
+        """
+        Leave the database backup and migration to the target that runs them for every target,
+        which finished before this one starts.
+        """
+        self.has_migration = False
+        self.migration_completed = self.migration > 0
 
     def all_deployments(self):
         return [deploy for sublist in self.deployments.values() for deploy in sublist]
 
+    def carry_over_interrupted(self):
+        """
+        Keep the original replicas of deployments an interrupted run of another tag scaled down,
+        and the original images and rollout of canaries it left paused, so set_image reverts
+        and resumes them before patching.
+        """
+        scaled_down = self.journal.get_scaled_down()
+        canaries = self.journal.get_canaries()
+        for deployment in self.all_deployments():
+            if deployment["name"] in scaled_down:
+                deployment["replicas"] = scaled_down[deployment["name"]]["replicas"]
+                deployment["scaled_down"] = True
+            if deployment["name"] in canaries:
+                canary = canaries[deployment["name"]]
+                deployment["images"] = canary["images"]
+                deployment["rollout"] = canary["canary_rollout"]
+                deployment["canary_rollout"] = canary["canary_rollout"]
+                deployment["updated_image"] = True
+                if "previous_replica_set" in canary:
+                    deployment["previous_replica_set"] = canary["previous_replica_set"]
+            if deployment["name"] in scaled_down or deployment["name"] in canaries:
+                self.carried_over.append(deployment)
+
+    def qualified_name(self, deployment: dict) -> str:
+        """
+        Deployment name, prefixed with the target when deploying to several targets.
+        """
+        if self.target is None:
+            return deployment["name"]
+        return "{}/{}".format(self.target.name, deployment["name"])
+
+    def has_scaled_down(self) -> bool:
+        return any(deployment.get("scaled_down", False) for deployment in self.all_deployments())
+
+    def has_pending_changes(self) -> bool:
+        return any(
+            deployment.get("scaled_down", False) or deployment.get("updated_image", False)
+            for deployment in self.all_deployments()
+        )
+
+    def save_journal(self):
+        self.journal.save(self.all_deployments())
+
+    def run_step(self, func, step: str = None):
+        """
+        Run a deploy step unless the journal shows an interrupted run for this tag completed it.
+        """
+        step = step or func.__name__
+        if self.journal.is_completed(step):
+            self.slacker.send_thread_reply("Skipping Completed Step: step={}".format(step))
+            return
+        func()
+        self.journal.complete_step(step, self.all_deployments())
+
+    def notify_resume(self):
+        if self.is_resumed:
+            self.slacker.send_thread_reply(
+                "Resuming Interrupted Deployment: completed_steps={}".format(
+                    ",".join(self.journal.completed_steps) or "none"
+                )
+            )
+        for deployment in self.carried_over:
+            if deployment.get("scaled_down", False):
+                self.slacker.send_thread_reply(
+                    "Restoring Deployment Left Scaled Down: deployment={} replicas={}".format(
+                        deployment["name"], deployment["replicas"]
+                    )
+                )
+            if "canary_rollout" in deployment:
+                self.slacker.send_thread_reply(
+                    "Reverting Canary Left Paused: deployment={}".format(deployment["name"])
+                )
+
+    def report_progress(self, deployment: dict, stage: str, state: str, step: str = None):
+        """
+        Record a deployment's state on the progress board, or post the step to the thread without one.
+        """
+        if self.board is not None:
+            self.board.set_state(self.qualified_name(deployment), state, stage=stage)
+        elif step is not None:
+            self.slacker.send_thread_reply(step)
+
+    def notify_untiered_deployments(self):
+        for deployment in self.inventory.get_untiered_deployments():
+            self.slacker.send_thread_reply(
+                "Skipping Deployment With Unknown Tier: deployment={} tier={}".format(
+                    deployment["name"], deployment["tier"]
+                )
+            )
+
     def send_release_notification(self):
         if not self.deploy_success:
             logging.debug("Skipping release notification due to deployment failure")
@@ -57,47 +205,233 @@ class Deployorama:
 
         if config.DISABLED:
             self.slacker.send_message(text="Automated deployment is currently disabled")
+            self.slacker.flush()
             return
 
-        error_message = None
-        error_handling_message = None
+        self.slacker.send_initial_message()
+        if config.SLACK_PROGRESS_BOARD:
+            self.board = ProgressBoard(
+                self.slacker,
+                [deployment["name"] for deployment in self.all_deployments()],
+                config.SLACK_BOARD_THROTTLE_SECONDS,
+            )
 
-        try:
-            self.slacker.send_initial_message()
-            self.kuber.get_cronjobs(label_selector="project={}".format(config.PROJECT))
+        self.run()
+
+        report = tracer.write_report(
+            config.DEPLOY_REPORT_PATH,
+            tag=self.tag,
+            migration=self.migration,
+            success=self.deploy_success,
+            error=self.error_message,
+        )
+        self.slacker.send_completion_message(
+            error_message=self.error_message,
+            error_handling_message=self.error_handling_message,
+            deployments=self.all_deployments(),
+            requires_migration_rollback=self.requires_migration_rollback(),
+            report_summary=summarize_report(report),
+        )
+        self.send_release_notification()
+        if self.board is not None:
+            self.board.close()
+        self.slacker.flush()
+        export_metrics(
+            tracer.get_report(tag=self.tag, migration=self.migration, success=self.deploy_success)
+        )
 
+    def plan(self) -> bool:
+        """
+        Print the deploy graph for the current cluster state and send every change it would
+        make as a dryRun=All request, without changing anything. Returns False if any
+        dry run was rejected.
+        """
+        print(format_plan(build_plan(self)))
+        checks = []
+        for deployment in self.all_deployments():
+            name = deployment["name"]
+            changed_images = get_changed_images(
+                deployment["images"], self.get_new_images(deployment["images"])
+            )
             if self.has_down_time:
-                self.scale_down_deployments()
+                checks.append(
+                    (
+                        "scale down deployment={}".format(name),
+                        lambda name=name: self.kuber.set_deployment_replicas(
+                            name, 0, dry_run=True
+                        ),
+                    )
+                )
+            if has_images(changed_images):
+                checks.append(
+                    (
+                        "set images deployment={}".format(name),
+                        lambda name=name, images=changed_images: self.kuber.set_deployment_images(
+                            name, images, dry_run=True
+                        ),
+                    )
+                )
+        if self.check_cronjobs:
+            for cronjob in self.cronjobs:
+                changed_images = get_changed_images(
+                    cronjob["images"], self.get_new_images(cronjob["images"])
+                )
+                if has_images(changed_images):
+                    checks.append(
+                        (
+                            "set images cronjob={}".format(cronjob["name"]),
+                            lambda name=cronjob["name"], images=changed_images: (
+                                self.kuber.set_cronjob_images(name, images, dry_run=True)
+                            ),
+                        )
+                    )
+        if config.PREFLIGHT_IMAGES:
+            checks.append(
+                (
+                    "release images exist",
+                    lambda: self.assert_images_exist(self.get_release_tags()),
+                )
+            )
+        if self.has_migration:
+            checks.append(
+                (
+                    "create migration job",
+                    lambda: self.kuber.dry_run_migration(self.tag, config.APP_MIGRATOR_SOURCE),
+                )
+            )
+        failures = 0
+        for description, check in checks:
+            try:
+                check()
+                print("dry run ok: {}".format(description))
+            except Exception as e:
+                failures += 1
+                print("dry run failed: {} error={}".format(description, str(e)))
+        return failures == 0
+
+    def journaled(self, func, step: str = None):
+        return lambda: self.run_step(func, step)
+
+    def build_graph(self) -> StepGraph:
+        """
+        Deploy steps with the state each one needs and produces, so independent steps overlap:
+        the migrator job is prepared during the backup and MIGRATION_INDEPENDENT_TIERS don't
+        wait on the migration. Cronjobs wait on every deployment rollout.
+        """
+        graph = StepGraph(config.MAX_CONCURRENCY)
+        verified = []
+        if config.PREFLIGHT_IMAGES:
+            graph.add("verify_images", self.verify_images, outputs=["images_verified"])
+            verified = ["images_verified"]
+        ready = verified
+        if self.has_down_time and config.PREPULL_IMAGES:
+            graph.add(
+                "prepull_images",
+                self.journaled(self.prepull_images),
+                inputs=ready,
+                outputs=["images_pulled"],
+            )
+            ready = ["images_pulled"]
+        if self.has_down_time:
+            graph.add(
+                "scale_down_deployments",
+                self.journaled(self.scale_down_deployments),
+                inputs=ready,
+                outputs=["scaled_down"],
+                rollback=self.scale_up_deployments,
+            )
+            ready = ["scaled_down"]
+        migrated = []
+        if self.has_migration:
+            migration_inputs = []
+            if not self.journal.is_completed("run_migration"):
+                graph.add(
+                    "backup_database",
+                    self.journaled(self.backup_database),
+                    inputs=ready,
+                    outputs=["database_backup"],
+                )
+                graph.add(
+                    "prepare_migration",
+                    self.prepare_migration,
+                    inputs=verified,
+                    outputs=["migrator_job"],
+                )
+                migration_inputs = ["database_backup", "migrator_job"]
+            graph.add(
+                "run_migration",
+                self.journaled(self.run_migration),
+                inputs=migration_inputs,
+                outputs=["migrated"],
+            )
+            migrated = ["migrated"]
 
-            if self.has_migration:
-                self.backup_database()
-                self.run_migration()
+        # tiers keep their order, independent tiers in a chain of their own during a migration
+        previous = {True: [], False: migrated}
+        for tier in config.TIERS:
+            independent = self.has_migration and tier in config.MIGRATION_INDEPENDENT_TIERS
+            step = "set_images:{}".format(tier)
+            graph.add(
+                step,
+                self.journaled(lambda tier=tier: self.set_images(tier), step),
+                inputs=ready + previous[independent],
+                outputs=[step],
+                rollback=lambda tier=tier: self.rollback_images(self.deployments[tier]),
+            )
+            previous[independent] = [step]
+        image_steps = ["set_images:{}".format(tier) for tier in config.TIERS]
 
-            self.set_images()
+        if self.check_cronjobs:
+            graph.add(
+                "set_cronjob_images",
+                self.journaled(self.set_cronjob_images),
+                inputs=image_steps + migrated,
+                outputs=["cronjob_images"],
+                rollback=self.rollback_cronjob_images,
+            )
+        if self.has_down_time or self.has_scaled_down():
+            graph.add(
+                "scale_up_deployments",
+                self.journaled(self.scale_up_deployments),
+                inputs=image_steps + migrated,
+                outputs=["scaled_up"],
+            )
+        return graph
 
-            if (self.check_cronjobs):
-                self.set_cronjob_images()
+    def assert_images_exist(self, images: List[str]):
+        missing = find_missing_images(images, config.MAX_CONCURRENCY)
+        if len(missing) > 0:
+            raise Exception("Image Not Found In Registry:\n{}".format("\n".join(missing)))
 
-            if self.has_down_time:
-                self.scale_up_deployments()
+    def requires_migration_rollback(self) -> bool:
+        return self.has_down_time and self.migration_completed
+
+    def run(self):
+        """
+        Run every deploy step, recovering from a failure instead of raising.
+        The outcome is left in deploy_success, error_message and error_handling_message.
+        """
+        graph = self.build_graph()
+        try:
+            self.notify_untiered_deployments()
+            self.notify_resume()
+            self.save_journal()
+            graph.run()
 
         except Exception as e:
             self.deploy_success = False
-            error_message = str(e)
-            logging.error(error_message)
-            error_handling_message = self.handle_deploy_failure()
+            self.error_message = str(e)
+            logging.error(self.error_message)
+            self.error_handling_message = self.handle_deploy_failure(graph)
 
-        self.slacker.send_completion_message(
-            error_message=error_message,
-            error_handling_message=error_handling_message,
-            deployments=self.all_deployments(),
-            requires_migration_rollback=self.has_down_time and self.migration_completed,
-        )
-        self.send_release_notification()
+        if self.deploy_success or not self.has_pending_changes():
+            self.journal.clear()
 
-    def handle_deploy_failure(self):
+    @tracer.traced
+    def handle_deploy_failure(self, graph: StepGraph):
         """
-        Handle deployment failure by reverting all modifications.
+        Handle deployment failure by reverting all modifications: the rollback handlers of
+        every step that ran, newest first, then anything an earlier run left changed.
         """
         step = "Recovering From Deployment Error"
         self.slacker.send_thread_reply(step)
@@ -106,7 +440,9 @@ class Deployorama:
             return "Skipped Automated Recovery: Requires Manual Intervention"
 
         try:
+            # every changed deployment is rolled back at once first, recovery time matters most
             self.rollback_images()
+            graph.rollback()
             self.scale_up_deployments()
             error_handler_message = "Successfully Rolled Back Deployment"
 
@@ -125,49 +461,133 @@ class Deployorama:
         self.slacker.send_thread_reply(error_message)
         raise Exception(error_message)
 
+    def run_for_tier(self, func, deployments: list):
+        """
+        Run a per-deployment step concurrently across a tier and raise once every deployment is done.
+        """
+        def run_traced(deployment: dict):
+            with tracer.span(func.__name__, deployment=self.qualified_name(deployment)):
+                func(deployment)
+
+        failures = run_concurrently(
+            tracer.bind(run_traced), deployments, config.MAX_CONCURRENCY
+        )
+        for deployment, _ in failures:
+            self.report_progress(deployment, stage=None, state=FAILED)
+        if len(failures) > 0:
+            raise Exception(
+                "\n".join(
+                    "deployment={} error={}".format(deployment["name"], str(error))
+                    for deployment, error in failures
+                )
+            )
+
+    def get_release_tags(self) -> List[str]:
+        """
+        Every distinct repository:tag the deploy will roll out.
+        """
+        objects = self.all_deployments() + (self.cronjobs if self.check_cronjobs else [])
+        return sorted(
+            {image for item in objects for image in get_release_tags(item["images"], self.tag)}
+        )
+
+    @tracer.traced
+    def verify_images(self):
+        """
+        Check every release image exists in its registry before anything is changed.
+        """
+        images = self.get_release_tags()
+        step = "Verifying Release Images:\n{}".format("\n".join(images))
+        try:
+            self.slacker.send_thread_reply(step)
+            self.assert_images_exist(images)
+        except Exception as e:
+            self.raise_step_error(step=step, error=e)
+
+    @tracer.traced
+    def prepull_images(self):
+        """
+        Pull every new deployment image on all nodes before the downtime starts.
+        """
+        images = sorted(
+            {
+                image
+                for deployment in self.all_deployments()
+                for containers in get_changed_images(
+                    deployment["images"], self.get_new_images(deployment["images"])
+                ).values()
+                for image in containers.values()
+            }
+        )
+        if len(images) == 0:
+            return
+        step = "Pre-pulling Images:\n{}".format("\n".join(images))
+        try:
+            self.slacker.send_thread_reply(step)
+            self.kuber.prepull_images(images, self.inventory.get_image_pull_secrets())
+        except Exception as e:
+            self.raise_step_error(step=step, error=e)
+
+    def verify_deployment(self, deployment: dict):
+        self.kuber.verify_deployment_update(
+            deployment["name"],
+            generation=deployment.get("generation"),
+            timeout=get_rollout_timeout(deployment),
+            termination_timeout=get_termination_timeout(deployment),
+        )
+
+    @tracer.traced
     def scale_down_deployments(self):
         """
         Scale down deployments.
         """
         try:
             for tier in config.TIERS:
-                for deployment in self.deployments[tier]:
-                    step = "Scaling Down Deployment:\ndeployment={}".format(
-                        deployment["name"]
-                    )
-                    self.slacker.send_thread_reply(step)
-                    deployment["scaled_down"] = True
-                    self.kuber.set_deployment_replicas(deployment["name"], 0)
-                step = "Verifying {} Deployments Scaled Down Successfully".format(tier)
-                self.slacker.send_thread_reply(step)
-                for deployment in self.deployments[tier]:
-                    self.kuber.verify_deployment_update(deployment["name"])
+                step = "Scaling Down {} Deployments".format(tier)
+                self.run_for_tier(self.scale_down_deployment, self.deployments[tier])
         except Exception as e:
             self.raise_step_error(step=step, error=e)
 
+    def scale_down_deployment(self, deployment: dict):
+        step = "Scaling Down Deployment:\ndeployment={}".format(deployment["name"])
+        self.report_progress(deployment, SCALE_DOWN_STAGE, PENDING, step)
+        deployment["scaled_down"] = True
+        self.save_journal()
+        deployment["generation"] = self.kuber.set_deployment_replicas(deployment["name"], 0)
+        self.report_progress(deployment, SCALE_DOWN_STAGE, VERIFYING)
+        self.verify_deployment(deployment)
+        self.report_progress(deployment, SCALE_DOWN_STAGE, DONE)
+
+    @tracer.traced
     def scale_up_deployments(self):
         """
         Scale up all deployments (in reverse order) to original replica counts.
         """
         try:
             for tier in config.TIERS[::-1]:
-                for deployment in self.deployments[tier]:
-                    if deployment.get("scaled_down", False) is True:
-                        step = "Scaling Up Deployment:\ndeployment={}\nreplicas={}".format(
-                            deployment["name"], deployment["replicas"]
-                        )
-                        self.slacker.send_thread_reply(step)
-                        self.kuber.set_deployment_replicas(
-                            deployment["name"], deployment["replicas"]
-                        )
-                        deployment["scaled_down"] = False
-                step = "Verifying {} Deployments Scaled Up Successfully".format(tier)
-                self.slacker.send_thread_reply(step)
-                for deployment in self.deployments[tier]:
-                    self.kuber.verify_deployment_update(deployment["name"])
+                step = "Scaling Up {} Deployments".format(tier)
+                self.run_for_tier(self.scale_up_deployment, self.deployments[tier])
         except Exception as e:
             self.raise_step_error(step=step, error=e)
 
+    def scale_up_deployment(self, deployment: dict):
+        if deployment.get("scaled_down", False) is False:
+            return
+        step = "Scaling Up Deployment:\ndeployment={}\nreplicas={}".format(
+            deployment["name"], deployment["replicas"]
+        )
+        self.report_progress(deployment, SCALE_UP_STAGE, PENDING, step)
+        deployment["generation"] = self.kuber.set_deployment_replicas(
+            deployment["name"], deployment["replicas"]
+        )
+        deployment["scaled_down"] = False
+        self.save_journal()
+        self.report_progress(deployment, SCALE_UP_STAGE, PATCHED)
+        self.report_progress(deployment, SCALE_UP_STAGE, VERIFYING)
+        self.verify_deployment(deployment)
+        self.report_progress(deployment, SCALE_UP_STAGE, DONE)
+
+    @tracer.traced
     def backup_database(self):
         """
         Store a cloud sql backup on google storage
@@ -179,20 +599,29 @@ class Deployorama:
         step = "Backing Up Database:\nbackup={}".format(backup_uri)
         try:
             self.slacker.send_thread_reply(step)
-            backup_command = [
-                "gcloud",
-                "sql",
-                "export",
-                "sql",
-                config.DATABASE_INSTANCE_NAME,
+            get_backup_backend().export(
                 backup_uri,
-                "--database={}".format(config.DATABASE_NAME),
-                "--verbosity=debug",
-            ]
-            subprocess.run(backup_command, check=True)
+                progress=lambda text: self.slacker.send_thread_reply(
+                    "Database Backup Progress: {}".format(text)
+                ),
+            )
+        except Exception as e:
+            self.raise_step_error(step=step, error=e)
+
+    @tracer.traced
+    def prepare_migration(self):
+        """
+        Clean up the previous app-migrator job and build the new one while the database backs up.
+        """
+        step = "Preparing Database Migration"
+        try:
+            self.migrator_job = self.kuber.prepare_migration(
+                tag=self.tag, source=config.APP_MIGRATOR_SOURCE
+            )
         except Exception as e:
             self.raise_step_error(step=step, error=e)
 
+    @tracer.traced
     def run_migration(self):
         """
         Perform database migration via k8 app-migrator job.
@@ -200,83 +629,357 @@ class Deployorama:
         step = "Migrating Database"
         try:
             self.slacker.send_thread_reply(step)
-            self.kuber.run_migration(tag=self.tag, source=config.APP_MIGRATOR_SOURCE)
+            self.kuber.run_migration(self.migrator_job, log_handler=self.send_migration_logs)
             self.migration_completed = True
         except Exception as e:
             self.raise_step_error(step=step, error=e)
 
-    def set_images(self):
+    def send_migration_logs(self, lines: list):
+        if len(lines) == 0:
+            return
+        self.slacker.send_thread_snippet(
+            title="{} logs".format(config.APP_MIGRATOR_SOURCE), content="\n".join(lines)
+        )
+
+    @tracer.traced
+    def set_images(self, tier: str):
         """
-        Update images for all deployments.
+        Update images for a tier's deployments.
         """
+        step = "Setting {} Deployment Images".format(tier)
         try:
-            for deployment in self.all_deployments():
-                new_image = self.get_new_image(deployment["image"])
-                step = "Setting Deployment Image:\ndeployment={}\nold_image={}\nnew_image={}".format(
-                    deployment["name"], deployment["image"], new_image
-                )
-                if deployment["image"] == new_image:
-                    self.slacker.send_thread_reply(
-                        "Deployment Doesn't Require Image Update: deployment={} image={}".format(
-                            deployment["name"], new_image
-                        )
-                    )
-                    continue
-                self.slacker.send_thread_reply(step)
-                self.kuber.set_deployment_image(deployment["name"], new_image)
-                deployment["updated_image"] = True
-            step = "Verifying Deployment Updates Completed Successfully"
-            self.slacker.send_thread_reply(step)
-            for deployment in self.all_deployments():
-                self.kuber.verify_deployment_update(deployment["name"])
+            self.run_for_tier(self.set_image, self.deployments[tier])
         except Exception as e:
             self.raise_step_error(step=step, error=e)
 
+    def set_image(self, deployment: dict):
+        if "canary_rollout" in deployment:
+            self.abort_canary(deployment)
+        new_images = self.get_new_images(deployment["images"])
+        changed_images = get_changed_images(deployment["images"], new_images)
+        if not has_images(changed_images):
+            step = "Deployment Doesn't Require Image Update: deployment={}\n{}".format(
+                deployment["name"], describe_images(new_images)
+            )
+            self.report_progress(deployment, SET_IMAGE_STAGE, DONE, step)
+            return
+        step = "Setting Deployment Images:\ndeployment={}\n{}".format(
+            deployment["name"], describe_image_changes(deployment["images"], new_images)
+        )
+        self.report_progress(deployment, SET_IMAGE_STAGE, PENDING, step)
+        if "previous_replica_set" not in deployment:
+            deployment["previous_replica_set"] = self.kuber.get_current_replica_set_name(
+                deployment["name"]
+            )
+        deployment["updated_image"] = True
+        self.save_journal()
+        if is_canary_deployment(deployment):
+            self.run_canary(deployment, changed_images)
+            started = time.time()
+        else:
+            started = time.time()
+            deployment["generation"] = self.kuber.set_deployment_images(
+                deployment["name"], changed_images
+            )
+        self.report_progress(deployment, SET_IMAGE_STAGE, PATCHED)
+        self.report_progress(deployment, SET_IMAGE_STAGE, VERIFYING)
+        self.verify_deployment(deployment)
+        self.record_rollout_seconds(deployment, time.time() - started)
+        self.report_progress(deployment, SET_IMAGE_STAGE, DONE)
+
+    def record_rollout_seconds(self, deployment: dict, seconds: float):
+        """
+        Keep the rollout time for the next deadline. Only bookkeeping, so a failed write never
+        fails a verified rollout.
+        """
+        try:
+            self.kuber.annotate_deployment(
+                deployment["name"], {ROLLOUT_SECONDS_ANNOTATION: str(round(seconds))}
+            )
+        except Exception as e:
+            logging.warning(
+                "Unable to record rollout seconds: deployment={} error={}".format(
+                    deployment["name"], str(e)
+                )
+            )
+
+    def run_canary(self, deployment: dict, changed_images: dict):
+        """
+        Roll the new images out to a few extra pods, pause, and bake them before the full rollout.
+        A failed canary is reverted while still paused, so the old pods never go away.
+        """
+        canary_pods = get_canary_pods(deployment)
+        step = "Starting Canary:\ndeployment={}\npods={}\nbake_seconds={:.0f}".format(
+            deployment["name"], canary_pods, config.CANARY_BAKE_SECONDS
+        )
+        self.report_progress(deployment, CANARY_STAGE, PENDING, step)
+        deployment["canary_rollout"] = deployment["rollout"]
+        self.save_journal()
+        self.kuber.start_canary(deployment["name"], changed_images, canary_pods)
+        self.report_progress(deployment, CANARY_STAGE, VERIFYING)
+        try:
+            self.kuber.verify_canary(
+                deployment["name"],
+                canary_pods,
+                config.CANARY_BAKE_SECONDS,
+                config.CANARY_MAX_RESTARTS,
+                probe=probe_canary,
+                timeout=get_rollout_timeout(deployment),
+            )
+        except Exception:
+            self.abort_canary(deployment)
+            raise
+        self.end_canary(deployment)
+        self.report_progress(deployment, CANARY_STAGE, DONE)
+
+    def end_canary(self, deployment: dict):
+        deployment["generation"] = self.kuber.resume_rollout(
+            deployment["name"], deployment["canary_rollout"]
+        )
+        del deployment["canary_rollout"]
+        self.save_journal()
+
+    def abort_canary(self, deployment: dict):
+        """
+        Put the original images back on a paused canary before resuming, then wait for it.
+        """
+        self.slacker.send_thread_reply(
+            "Reverting Canary: deployment={}".format(deployment["name"])
+        )
+        self.kuber.set_deployment_images(deployment["name"], deployment["images"])
+        deployment["updated_image"] = False
+        self.end_canary(deployment)
+        self.verify_deployment(deployment)
+
+    @tracer.traced
     def set_cronjob_images(self):
         """
         Update images for all cronjobs.
         """
         try:
             for cronjob in self.cronjobs:
-                new_image = self.get_new_image(cronjob["image"])
-                step = "Setting Cronjob Image:\ncronjob={}\nold_image={}\nnew_image={}".format(
-                    cronjob["name"], cronjob["image"], new_image
+                new_images = self.get_new_images(cronjob["images"])
+                changed_images = get_changed_images(cronjob["images"], new_images)
+                step = "Setting Cronjob Images:\ncronjob={}\n{}".format(
+                    cronjob["name"], describe_image_changes(cronjob["images"], new_images)
                 )
-                if (cronjob["image"] == new_image):
+                if not has_images(changed_images):
                     self.slacker.send_thread_reply(
-                        "Cronjob Doesn't Require Image Update: cronjob={} image={}".format(
-                            cronjob["name"], new_image
+                        "Cronjob Doesn't Require Image Update: cronjob={}\n{}".format(
+                            cronjob["name"], describe_images(new_images)
                         )
                     )
                     continue
                 self.slacker.send_thread_reply(step)
-                self.kuber.set_cronjob_image(cronjob["name"], new_image)
+                cronjob["updated_image"] = True
+                self.kuber.set_cronjob_images(cronjob["name"], changed_images)
             step = "Cronjob Updates Completed"
             self.slacker.send_thread_reply(step)
 
         except Exception as e:
             self.raise_step_error(step=step, error=e)
 
-    def rollback_images(self):
+    @tracer.traced
+    def rollback_cronjob_images(self):
         """
-        Rollback all deployment images to their original state prior to deployment.
+        Rollback cronjob images this run updated to their original state prior to deployment.
         """
-        for deployment in self.all_deployments():
-            if deployment.get("updated_image", False) is False:
-                continue
-            step = "Rolling Back Deployment Image:\ndeployment={}\nattempted_image={}\nrollback_image={}".format(
-                deployment["name"],
-                self.get_new_image(deployment["image"]),
-                deployment["image"],
-            )
-            try:
+        step = "Rolling Back Cronjob Images"
+        try:
+            for cronjob in self.cronjobs:
+                if cronjob.get("updated_image", False) is False:
+                    continue
+                self.journal.reopen_step("set_cronjob_images", self.all_deployments())
+                step = "Rolling Back Cronjob Images:\ncronjob={}\n{}".format(
+                    cronjob["name"],
+                    describe_image_changes(
+                        self.get_new_images(cronjob["images"]), cronjob["images"]
+                    ),
+                )
                 self.slacker.send_thread_reply(step)
-                self.kuber.set_deployment_image(
-                    deployment["name"], deployment["image"], verify_update=True
+                self.kuber.set_cronjob_images(cronjob["name"], cronjob["images"])
+                cronjob["updated_image"] = False
+        except Exception as e:
+            self.raise_step_error(step=step, error=e)
+
+    @tracer.traced
+    def rollback_images(self, deployments: List[dict] = None):
+        """
+        Rollback deployment images (all by default) to their original state prior to deployment.
+        """
+        if deployments is None:
+            deployments = self.all_deployments()
+        step = "Rolling Back Deployment Images"
+        try:
+            self.run_for_tier(
+                self.rollback_image,
+                [
+                    deployment
+                    for deployment in deployments
+                    if "canary_rollout" in deployment or deployment.get("updated_image", False)
+                ],
+            )
+        except Exception as e:
+            self.raise_step_error(step=step, error=e)
+
+    def rollback_image(self, deployment: dict):
+        """
+        Restore the ReplicaSet the deployment ran before this deploy, scaling it straight back
+        up, and fall back to patching the original images when it no longer exists.
+        """
+        step = "set_images:{}".format(deployment["tier"])
+        self.journal.reopen_step(step, self.all_deployments())
+        if "canary_rollout" in deployment:
+            self.abort_canary(deployment)
+        if deployment.get("updated_image", False) is False:
+            return
+        previous_replica_set = deployment.get("previous_replica_set")
+        step = "Rolling Back Deployment Images:\ndeployment={}\nreplica_set={}\n{}".format(
+            deployment["name"],
+            previous_replica_set,
+            describe_image_changes(
+                self.get_new_images(deployment["images"]), deployment["images"]
+            ),
+        )
+        self.report_progress(deployment, ROLLBACK_STAGE, PENDING, step)
+        generation = None
+        if previous_replica_set is not None:
+            generation = self.kuber.restore_replica_set(deployment["name"], previous_replica_set)
+        if generation is None:
+            generation = self.kuber.set_deployment_images(deployment["name"], deployment["images"])
+        deployment["generation"] = generation
+        self.report_progress(deployment, ROLLBACK_STAGE, VERIFYING)
+        self.verify_deployment(deployment)
+        deployment["updated_image"] = False
+        self.save_journal()
+        self.report_progress(deployment, ROLLBACK_STAGE, DONE)
+
+
+class FanOutDeployorama:
+    """
+    Deploy the same tag to several targets, wave by wave, in one Slack thread and report.
+    Targets within a wave run at the same time, a failed wave stops the following ones.
+    The database is backed up and migrated once, by the single target of the first wave.
+    """
+
+    def __init__(self, waves: List[List[DeployTarget]]):
+        self.tag = config.TAG
+        self.migration = config.MIGRATION_LEVEL
+        if self.migration > 0 and len(waves[0]) > 1:
+            raise ValueError(
+                "The first wave must be a single target when migrating: targets={}".format(
+                    ",".join(target.name for target in waves[0])
                 )
-                deployment["updated_image"] = False
-            except Exception as e:
-                self.raise_step_error(step=step, error=e)
+            )
+        self.slacker = SlackApi()
+        self.waves = [
+            [Deployorama(target, TargetSlacker(self.slacker, target.name)) for target in wave]
+            for wave in waves
+        ]
+        # every target shares DATABASE_INSTANCE_NAME, so only the first one backs up and migrates
+        for deployer in self.all_deployers()[1:]:
+            deployer.skip_migration()
+        self.skipped = []
+        self.board = None
+
+    def all_deployers(self) -> List[Deployorama]:
+        return [deployer for wave in self.waves for deployer in wave]
+
+    def is_success(self) -> bool:
+        return len(self.skipped) == 0 and all(
+            deployer.deploy_success for deployer in self.all_deployers()
+        )
+
+    def plan(self) -> bool:
+        passed = True
+        for index, wave in enumerate(self.waves):
+            for deployer in wave:
+                print("\n# wave {} target {}".format(index + 1, deployer.target.name))
+                passed = deployer.plan() and passed
+        return passed
+
+    def run_target(self, deployer: Deployorama):
+        with tracer.span("deploy_target", target=deployer.target.name):
+            deployer.run()
+
+    def deploy(self):
+        if config.DISABLED:
+            self.slacker.send_message(text="Automated deployment is currently disabled")
+            self.slacker.flush()
+            return
+
+        self.slacker.send_initial_message(
+            waves=[[deployer.target.name for deployer in wave] for wave in self.waves]
+        )
+        if config.SLACK_PROGRESS_BOARD:
+            self.board = ProgressBoard(
+                self.slacker,
+                [
+                    deployer.qualified_name(deployment)
+                    for deployer in self.all_deployers()
+                    for deployment in deployer.all_deployments()
+                ],
+                config.SLACK_BOARD_THROTTLE_SECONDS,
+            )
+            for deployer in self.all_deployers():
+                deployer.board = self.board
+
+        for wave in self.waves:
+            if not self.is_success():
+                self.skipped.extend(wave)
+                continue
+            run_concurrently(tracer.bind(self.run_target), wave, len(wave))
+
+        failed = [deployer for deployer in self.all_deployers() if not deployer.deploy_success]
+        error_message = None
+        error_handling_message = None
+        if not self.is_success():
+            error_message = "\n".join(
+                "target={} error={}".format(deployer.target.name, deployer.error_message)
+                for deployer in failed
+            )
+            outcomes = [
+                (deployer, deployer.error_handling_message) for deployer in failed
+            ] + [(deployer, "Skipped") for deployer in self.skipped]
+            error_handling_message = "\n".join(
+                "{}: {}".format(deployer.target.name, outcome) for deployer, outcome in outcomes
+            )
+        targets = {
+            deployer.target.name: {
+                "success": deployer.deploy_success and deployer not in self.skipped,
+                "error": deployer.error_message,
+            }
+            for deployer in self.all_deployers()
+        }
+        report = tracer.write_report(
+            config.DEPLOY_REPORT_PATH,
+            tag=self.tag,
+            migration=self.migration,
+            success=self.is_success(),
+            error=error_message,
+            targets=targets,
+        )
+        self.slacker.send_completion_message(
+            error_message=error_message,
+            error_handling_message=error_handling_message,
+            deployments=[
+                dict(deployment, name=deployer.qualified_name(deployment))
+                for deployer in failed
+                for deployment in deployer.all_deployments()
+            ],
+            requires_migration_rollback=any(
+                deployer.requires_migration_rollback() for deployer in failed
+            ),
+            report_summary=summarize_report(report),
+        )
+        if self.is_success():
+            cleanup_trello()
+        if self.board is not None:
+            self.board.close()
+        self.slacker.flush()
+        export_metrics(
+            tracer.get_report(tag=self.tag, migration=self.migration, success=self.is_success())
+        )
 
 
 if __name__ == "__main__":
@@ -301,11 +1004,24 @@ if __name__ == "__main__":
         required=False,
         choices=[True, False]
     )
+    parser.add_argument(
+        "--plan",
+        help="Print the deploy graph and dry run every change without deploying.",
+        action="store_true",
+    )
     args = parser.parse_args()
     config.TAG = args.tag.strip()
     config.MIGRATION_LEVEL = args.migration
     config.CHECK_CRONJOBS = args.cronjob
 
-    deployer = Deployorama()
+    if config.DEPLOY_TARGETS:
+        deployer = FanOutDeployorama(parse_waves(config.DEPLOY_TARGETS))
+    else:
+        deployer = Deployorama()
+    if args.plan:
+        passed = deployer.plan()
+        # os._exit skips interpreter shutdown, which would otherwise flush a piped stdout
+        sys.stdout.flush()
+        os._exit(os.EX_OK if passed else 1)
     deployer.deploy()
     os._exit(os.EX_OK)
@@ -0,0 +1,76 @@
+import config
+import logging
+import requests
+from lib.jobWatch import WAITING_FAILURES
+from lib.waitPolicy import resolve_int_or_percent
+
+log = logging.getLogger(__name__)
+
+PROBE_TIMEOUT_SECONDS = 5
+
+
+def is_canary_deployment(deployment: dict) -> bool:
+    """
+    Deployments in CANARY_TIERS with a rolling update strategy and more than one replica,
+    unless scaled down for a cold migration, where a canary would get no pods.
+    """
+    return (
+        deployment["tier"] in config.CANARY_TIERS
+        and not deployment.get("scaled_down", False)
+        and deployment["rollout"]["strategy"] == "RollingUpdate"
+        and (deployment["replicas"] or 0) > 1
+    )
+
+
+def get_canary_pods(deployment: dict) -> int:
+    """
+    Number of new pods rolled out before the bake, CANARY_PODS resolved against the replicas.
+    """
+    pods = config.CANARY_PODS
+    value = int(pods) if pods.isdigit() else pods
+    return max(1, resolve_int_or_percent(value, deployment["replicas"], round_up=True))
+
+
+def is_pod_ready(pod) -> bool:
+    return any(
+        condition.type == "Ready" and condition.status == "True"
+        for condition in pod.status.conditions or []
+    )
+
+
+def get_canary_failure(pod, max_restarts: int, require_ready: bool) -> str:
+    """
+    Describe why a canary pod fails the health gate, or None while it passes.
+    """
+    name = pod.metadata.name
+    if pod.status.phase == "Failed":
+        return "pod={} phase=Failed reason={}".format(name, pod.status.reason)
+    for status in pod.status.container_statuses or []:
+        if status.restart_count > max_restarts:
+            return "pod={} container={} restarts={}".format(
+                name, status.name, status.restart_count
+            )
+        waiting = status.state.waiting if status.state is not None else None
+        if waiting is not None and waiting.reason in WAITING_FAILURES:
+            return "pod={} container={} reason={} message={}".format(
+                name, status.name, waiting.reason, waiting.message
+            )
+    if require_ready and not is_pod_ready(pod):
+        return "pod={} not ready".format(name)
+    return None
+
+
+def probe_canary(deployment: str) -> str:
+    """
+    GET CANARY_PROBE_URL for the deployment, returning the failure or None when it's healthy.
+    """
+    if not config.CANARY_PROBE_URL:
+        return None
+    url = config.CANARY_PROBE_URL.format(deployment=deployment)
+    try:
+        response = requests.get(url, timeout=PROBE_TIMEOUT_SECONDS)
+    except requests.RequestException as e:
+        return "probe={} error={}".format(url, str(e))
+    if response.status_code >= 400:
+        return "probe={} status={}".format(url, response.status_code)
+    return None
@@ -0,0 +1,171 @@
+import config
+import logging
+import requests
+import subprocess
+import time
+from lib.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT_SECONDS = 30
+INITIAL_POLL_SECONDS = 1
+MAX_POLL_SECONDS = 15
+POLL_BACKOFF = 1.5
+OPERATION_DONE = "DONE"
+UNAUTHORIZED = 401
+# operation poll failures retried with the poll backoff, the export keeps running meanwhile
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+MAX_POLL_ERRORS = 5
+
+
+class SqlAdminError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class GcloudBackup:
+    """
+    Cloud SQL export through the gcloud cli
+    """
+
+    def export(self, backup_uri: str, progress):
+        command = [
+            "gcloud",
+            "sql",
+            "export",
+            "sql",
+            config.DATABASE_INSTANCE_NAME,
+            backup_uri,
+            "--database={}".format(config.DATABASE_NAME),
+            "--verbosity=debug",
+        ]
+        subprocess.run(command, check=True)
+
+
+class SqlAdminBackup:
+    """
+    Cloud SQL export through the SQL Admin api, waiting on the export operation with backoff.
+    Application default credentials are refreshed whenever the token expires, so exports
+    longer than the token lifetime keep being polled.
+    """
+
+    def __init__(self):
+        self.base_url = config.SQL_ADMIN_URL.rstrip("/")
+        self.project = config.DATABASE_PROJECT
+        self.token = config.SQL_ADMIN_TOKEN
+        self.credentials = None
+        if self.token is None or self.project is None:
+            self.load_credentials()
+
+    def load_credentials(self):
+        import google.auth
+
+        credentials, project = google.auth.default(
+            scopes=["https://www.googleapis.com/auth/sqlservice.admin"]
+        )
+        self.project = self.project or project
+        if self.token is None:
+            self.credentials = credentials
+            self.refresh_token()
+
+    def refresh_token(self):
+        import google.auth.transport.requests
+
+        log.debug("Refreshing SQL Admin credentials")
+        self.credentials.refresh(google.auth.transport.requests.Request())
+        self.token = self.credentials.token
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.credentials is not None and not self.credentials.valid:
+            self.refresh_token()
+        return requests.request(
+            method,
+            url,
+            headers={"Authorization": "Bearer {}".format(self.token)},
+            timeout=REQUEST_TIMEOUT_SECONDS,
+            **kwargs,
+        )
+
+    def request(self, method: str, path: str, **kwargs) -> dict:
+        url = "{}/sql/v1beta4/projects/{}/{}".format(self.base_url, self.project, path)
+        response = self.send(method, url, **kwargs)
+        if response.status_code == UNAUTHORIZED and self.credentials is not None:
+            self.refresh_token()
+            response = self.send(method, url, **kwargs)
+        if response.status_code != 200:
+            raise SqlAdminError(
+                f"Something went wrong requesting {url}: {response.text}", response.status_code
+            )
+        return response.json()
+
+    def poll_operation(self, operation: dict, poll_errors: int) -> tuple:
+        """
+        Fetch the operation again, keeping the last state on a transient error.
+        Returns the operation and the number of consecutive poll errors.
+        """
+        try:
+            return self.request("GET", "operations/{}".format(operation["name"])), 0
+        except (requests.RequestException, SqlAdminError) as e:
+            is_retryable = not isinstance(e, SqlAdminError) or e.status in RETRYABLE_STATUSES
+            if not is_retryable or poll_errors + 1 > MAX_POLL_ERRORS:
+                raise
+            log.warning(
+                "Database export poll failed, retrying: operation={} error={}".format(
+                    operation["name"], str(e)
+                )
+            )
+            return operation, poll_errors + 1
+
+    def export(self, backup_uri: str, progress):
+        operation = self.request(
+            "POST",
+            "instances/{}/export".format(config.DATABASE_INSTANCE_NAME),
+            json={
+                "exportContext": {
+                    "fileType": "SQL",
+                    "uri": backup_uri,
+                    "databases": [config.DATABASE_NAME],
+                }
+            },
+        )
+        log.debug("Started database export: operation={}".format(operation["name"]))
+        self.wait_for_operation(operation, progress)
+
+    def wait_for_operation(self, operation: dict, progress):
+        started = time.time()
+        last_progress = started
+        status = None
+        poll_seconds = INITIAL_POLL_SECONDS
+        poll_errors = 0
+        while True:
+            elapsed = time.time() - started
+            is_progress_due = time.time() - last_progress >= config.BACKUP_PROGRESS_SECONDS
+            if operation["status"] != status or is_progress_due:
+                status = operation["status"]
+                last_progress = time.time()
+                progress("status={} elapsed={:.0f}s".format(status, elapsed))
+            if status == OPERATION_DONE:
+                break
+            tracer.sleep(poll_seconds)
+            poll_seconds = min(poll_seconds * POLL_BACKOFF, MAX_POLL_SECONDS)
+            operation, poll_errors = self.poll_operation(operation, poll_errors)
+        errors = operation.get("error", {}).get("errors", [])
+        if len(errors) > 0:
+            raise Exception(
+                "Database Export Failed: operation={} errors={}".format(
+                    operation["name"],
+                    ", ".join(error.get("message", error.get("code", "")) for error in errors),
+                )
+            )
+
+
+BACKUP_BACKENDS = {"sqladmin": SqlAdminBackup, "gcloud": GcloudBackup}
+
+
+def get_backup_backend():
+    if config.DATABASE_BACKUP_BACKEND not in BACKUP_BACKENDS:
+        raise ValueError(
+            "Unknown database backup backend: backend={}".format(config.DATABASE_BACKUP_BACKEND)
+        )
+    return BACKUP_BACKENDS[config.DATABASE_BACKUP_BACKEND]()
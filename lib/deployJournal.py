@@ -0,0 +1,182 @@
+import config
+import json
+import logging
+import os
+from threading import Lock
+from typing import List
+from lib.kubeApi import KubeApi
+
+log = logging.getLogger(__name__)
+
+JOURNAL_KEY = "journal"
+# per-deployment fields a resumed run needs to finish or roll back
+DEPLOYMENT_FIELDS = [
+    "replicas",
+    "images",
+    "scaled_down",
+    "updated_image",
+    "canary_rollout",
+    "previous_replica_set",
+]
+
+
+class ConfigMapStore:
+    """
+    Journal kept in a config map, so it outlives the deploy pod
+    """
+
+    def __init__(self, kuber: KubeApi, name: str):
+        self.kuber = kuber
+        self.name = name
+
+    def load(self) -> str:
+        data = self.kuber.read_config_map(self.name)
+        return data.get(JOURNAL_KEY) if data is not None else None
+
+    def save(self, journal: str):
+        self.kuber.write_config_map(self.name, {JOURNAL_KEY: journal})
+
+    def clear(self):
+        self.kuber.delete_config_map(self.name)
+
+
+class FileStore:
+    """
+    Journal kept in a local file, for running locally and testing
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> str:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as journal_file:
+            return journal_file.read()
+
+    def save(self, journal: str):
+        with open(self.path, "w") as journal_file:
+            journal_file.write(journal)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DeployJournal:
+    """
+    Write-ahead record of completed steps and each deployment's original state,
+    so a deploy interrupted partway can be resumed or rolled back by the next run
+    """
+
+    def __init__(self, store, tag: str, migration: int):
+        self.store = store
+        self.tag = tag
+        self.migration = migration
+        self.lock = Lock()
+        self.completed_steps = []
+        self.previous = None
+
+    def load(self) -> bool:
+        """
+        Read the previous run's journal. Returns True when it is for the same tag and
+        migration level, so the run can resume from it.
+        """
+        journal = self.store.load()
+        if journal is None:
+            return False
+        self.previous = json.loads(journal)
+        if self.previous["tag"] != self.tag or self.previous["migration"] != self.migration:
+            return False
+        self.completed_steps = self.previous["completed_steps"]
+        return True
+
+    def get_scaled_down(self) -> dict:
+        """
+        Deployments the previous run left scaled down, with the fields needed to restore them.
+        """
+        if self.previous is None:
+            return {}
+        return {
+            name: deployment
+            for name, deployment in self.previous["deployments"].items()
+            if deployment.get("scaled_down", False) is True
+        }
+
+    def get_canaries(self) -> dict:
+        """
+        Deployments the previous run left paused mid canary, with their original images,
+        rollout and ReplicaSet.
+        """
+        if self.previous is None:
+            return {}
+        return {
+            name: deployment
+            for name, deployment in self.previous["deployments"].items()
+            if "canary_rollout" in deployment
+        }
+
+    def restore_deployments(self, deployments: List[dict]):
+        """
+        Carry the previous run's original replicas, images and flags over to fresh inventory.
+        """
+        for deployment in deployments:
+            previous = self.previous["deployments"].get(deployment["name"])
+            if previous is not None:
+                deployment.update(previous)
+
+    def is_completed(self, step: str) -> bool:
+        return step in self.completed_steps
+
+    def complete_step(self, step: str, deployments: List[dict]):
+        with self.lock:
+            self.completed_steps.append(step)
+        self.save(deployments)
+
+    def reopen_step(self, step: str, deployments: List[dict]):
+        """
+        Mark a step as not completed before its changes are rolled back, so a rerun of the tag
+        redoes it instead of skipping it.
+        """
+        with self.lock:
+            if step not in self.completed_steps:
+                return
+            self.completed_steps.remove(step)
+        self.save(deployments)
+
+    def save(self, deployments: List[dict]):
+        with self.lock:
+            journal = json.dumps(
+                {
+                    "tag": self.tag,
+                    "migration": self.migration,
+                    "completed_steps": self.completed_steps,
+                    "deployments": {
+                        deployment["name"]: {
+                            field: deployment[field]
+                            for field in DEPLOYMENT_FIELDS
+                            if field in deployment
+                        }
+                        for deployment in deployments
+                    },
+                }
+            )
+            self.store.save(journal)
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+
+
+def get_journal_store(kuber: KubeApi, target: str = None):
+    """
+    Journal store for the backend in JOURNAL_BACKEND. Config maps already live in the target's
+    namespace, journal files get the target appended so fan-out targets don't share one.
+    """
+    if config.JOURNAL_BACKEND == "configmap":
+        return ConfigMapStore(kuber, "{}-deploy-journal".format(config.PROJECT))
+    if config.JOURNAL_BACKEND == "file":
+        if target is None:
+            return FileStore(config.JOURNAL_PATH)
+        return FileStore("{}.{}".format(config.JOURNAL_PATH, target))
+    raise ValueError("Unknown journal backend: backend={}".format(config.JOURNAL_BACKEND))
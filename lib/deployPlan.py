@@ -0,0 +1,209 @@
+import config
+import json
+import math
+import os
+from typing import Dict, List, NamedTuple
+from lib.canary import get_canary_pods, is_canary_deployment
+from lib.imageMap import describe_image_changes, get_changed_images, has_images
+from lib.waitPolicy import (
+    DEFAULT_TERMINATION_GRACE_SECONDS,
+    ROLLOUT_SECONDS_ANNOTATION,
+    get_annotation_seconds,
+    get_rollout_batches,
+)
+
+
+class PlanStep(NamedTuple):
+    """
+    Deploy step with the steps it waits on, what it changes and its estimated seconds
+    """
+
+    name: str
+    depends_on: List[str]
+    details: List[str]
+    estimate_seconds: float
+    completed: bool
+
+
+def load_step_history(path: str) -> Dict[str, float]:
+    """
+    Longest time of every span name in the last deploy report, empty without one.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as report_file:
+            report = json.load(report_file)
+    except (OSError, ValueError):
+        return {}
+    history = {}
+    for span in report.get("spans", []):
+        if span["seconds"] is not None:
+            history[span["name"]] = max(history.get(span["name"], 0), span["seconds"])
+    return history
+
+
+def is_planned_canary(deployer, deployment: dict) -> bool:
+    """
+    Whether set_image canaries the deployment, never while it's scaled down for a cold migration.
+    """
+    return not deployer.has_down_time and is_canary_deployment(deployment)
+
+
+def estimate_rollout(deployment: dict, canary: bool = False) -> float:
+    """
+    Last recorded rollout time, otherwise ROLLOUT_BATCH_SECONDS per surge batch.
+    """
+    seconds = get_annotation_seconds(deployment, ROLLOUT_SECONDS_ANNOTATION)
+    if seconds is None:
+        seconds = get_rollout_batches(deployment) * config.ROLLOUT_BATCH_SECONDS
+    if canary:
+        seconds += config.CANARY_BAKE_SECONDS
+    return seconds
+
+
+def estimate_termination(deployment: dict) -> float:
+    grace = deployment["rollout"]["termination_grace_seconds"]
+    return grace if grace is not None else DEFAULT_TERMINATION_GRACE_SECONDS
+
+
+def estimate_tier(deployments: List[dict], estimate) -> float:
+    """
+    Deployments in a tier run MAX_CONCURRENCY at a time.
+    """
+    if len(deployments) == 0:
+        return 0
+    batches = math.ceil(len(deployments) / config.MAX_CONCURRENCY)
+    return batches * max(estimate(deployment) for deployment in deployments)
+
+
+def describe_deployment_change(deployer, deployment: dict) -> str:
+    new_images = deployer.get_new_images(deployment["images"])
+    if not has_images(get_changed_images(deployment["images"], new_images)):
+        return "{}: unchanged".format(deployment["name"])
+    lines = [deployment["name"] + ":"]
+    if is_planned_canary(deployer, deployment):
+        lines.append(
+            "  canary pods={} bake_seconds={:.0f}".format(
+                get_canary_pods(deployment), config.CANARY_BAKE_SECONDS
+            )
+        )
+    lines.extend(
+        "  " + line
+        for line in describe_image_changes(deployment["images"], new_images).split("\n")
+    )
+    return "\n".join(lines)
+
+
+def describe_tiers(deployer, tiers: List[str], describe) -> List[str]:
+    return [
+        "{}: {}".format(tier, ", ".join(describe(d) for d in deployer.deployments[tier]))
+        for tier in tiers
+        if len(deployer.deployments[tier]) > 0
+    ]
+
+
+def describe_step(deployer, name: str) -> tuple:
+    """
+    What a deploy graph step changes and its estimated seconds without history.
+    """
+    step, _, tier = name.partition(":")
+    if step == "prepull_images":
+        return [], config.ROLLOUT_BATCH_SECONDS
+    if step == "scale_down_deployments":
+        return (
+            describe_tiers(deployer, config.TIERS, lambda d: d["name"]),
+            sum(
+                estimate_tier(deployer.deployments[tier], estimate_termination)
+                for tier in config.TIERS
+            ),
+        )
+    if step == "backup_database":
+        return [
+            "instance={} database={}".format(config.DATABASE_INSTANCE_NAME, config.DATABASE_NAME)
+        ], 0
+    if step == "prepare_migration":
+        return ["source={}".format(config.APP_MIGRATOR_SOURCE)], 0
+    if step == "run_migration":
+        return ["job={}-migrator".format(config.PROJECT)], 0
+    if step == "set_images":
+        deployments = deployer.deployments[tier]
+        return (
+            [describe_deployment_change(deployer, deployment) for deployment in deployments],
+            estimate_tier(
+                deployments,
+                lambda deployment: estimate_rollout(
+                    deployment, canary=is_planned_canary(deployer, deployment)
+                ),
+            ),
+        )
+    if step == "set_cronjob_images":
+        return [
+            "{}:\n  {}".format(
+                cronjob["name"],
+                describe_image_changes(
+                    cronjob["images"], deployer.get_new_images(cronjob["images"])
+                ).replace("\n", "\n  ")
+                or "unchanged",
+            )
+            for cronjob in deployer.cronjobs
+        ], 0
+    if step == "scale_up_deployments":
+        return (
+            describe_tiers(
+                deployer,
+                config.TIERS[::-1],
+                lambda d: "{} replicas={}".format(d["name"], d["replicas"]),
+            ),
+            sum(
+                estimate_tier(deployer.deployments[tier], estimate_rollout)
+                for tier in config.TIERS
+            ),
+        )
+    return [], 0
+
+
+def build_plan(deployer) -> List[PlanStep]:
+    """
+    The steps of Deployorama's deploy graph for the current cluster state.
+    """
+    history = load_step_history(config.DEPLOY_REPORT_PATH)
+    graph = deployer.build_graph()
+    steps = []
+    for step in graph.steps:
+        details, estimate_seconds = describe_step(deployer, step.name)
+        steps.append(
+            PlanStep(
+                name=step.name,
+                depends_on=graph.get_dependencies(step),
+                details=details,
+                estimate_seconds=history.get(step.name, estimate_seconds),
+                completed=deployer.journal.is_completed(step.name),
+            )
+        )
+    return steps
+
+
+def get_critical_path_seconds(steps: List[PlanStep]) -> float:
+    finished = {}
+    for step in steps:
+        started = max((finished[name] for name in step.depends_on), default=0)
+        finished[step.name] = started + (0 if step.completed else step.estimate_seconds)
+    return max(finished.values(), default=0)
+
+
+def format_plan(steps: List[PlanStep]) -> str:
+    lines = []
+    for step in steps:
+        lines.append(
+            "{}{} <- [{}] ~{:.0f}s".format(
+                step.name,
+                " (completed, skipped on resume)" if step.completed else "",
+                ", ".join(step.depends_on),
+                step.estimate_seconds,
+            )
+        )
+        for detail in step.details:
+            lines.extend("    " + line for line in detail.split("\n"))
+    lines.append("estimated duration ~{:.0f}s".format(get_critical_path_seconds(steps)))
+    return "\n".join(lines)
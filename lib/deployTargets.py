@@ -0,0 +1,40 @@
+import config
+import re
+from typing import List, NamedTuple
+
+
+class DeployTarget(NamedTuple):
+    """
+    Namespace in a kube config context, None for the default cluster
+    """
+
+    context: str
+    namespace: str
+
+    @property
+    def name(self) -> str:
+        if self.context is None:
+            return self.namespace
+        return "{}@{}".format(self.namespace, self.context)
+
+    @property
+    def slug(self) -> str:
+        return re.sub(r"[^\w.-]", "_", self.name)
+
+
+def parse_target(text: str) -> DeployTarget:
+    namespace, _, context = text.partition("@")
+    return DeployTarget(context=context or None, namespace=namespace or config.NAMESPACE)
+
+
+def parse_waves(spec: str) -> List[List[DeployTarget]]:
+    """
+    Targets from "namespace@context,namespace@context;namespace@context", waves separated by
+    semicolons and deployed one after another, targets within a wave at the same time.
+    """
+    waves = []
+    for wave in spec.split(";"):
+        targets = [parse_target(text.strip()) for text in wave.split(",") if text.strip()]
+        if len(targets) > 0:
+            waves.append(targets)
+    return waves
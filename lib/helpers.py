@@ -1,2 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from lib.imageReference import parse_image
+
+
+def get_repository(image):
+    return parse_image(image).name
+
+
 def generate_image(old_image, new_tag):
-    return old_image.rsplit(":")[0] + f":{new_tag}"
+    return str(parse_image(old_image).with_tag(new_tag))
+
+
+def run_concurrently(func, items, max_workers):
+    """
+    Call func on every item with at most max_workers in flight.
+    Waits for all calls to finish and returns a list of (item, error) for the ones that raised.
+    """
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        futures = [(item, executor.submit(func, item)) for item in items]
+    return [(item, future.exception()) for item, future in futures if future.exception() is not None]
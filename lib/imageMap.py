@@ -0,0 +1,120 @@
+import config
+from typing import List, Set
+from lib.helpers import generate_image, get_repository
+from lib.imageReference import parse_image
+from lib.registry import get_manifest_digest
+
+# pod spec list fields holding containers, keyed by their name in patches
+CONTAINER_FIELDS = {"initContainers": "init_containers", "containers": "containers"}
+
+
+def get_pod_spec_images(pod_spec) -> dict:
+    """
+    Map every container and init container name to its image, grouped by pod spec field.
+    """
+    return {
+        field: {
+            container.name: container.image
+            for container in getattr(pod_spec, attribute) or []
+        }
+        for field, attribute in CONTAINER_FIELDS.items()
+    }
+
+
+def get_retag_repositories(images: dict) -> Set[str]:
+    """
+    Repositories that share the release tag: IMAGE_REPOSITORIES when set,
+    otherwise the repository of the first container.
+    """
+    if len(config.IMAGE_REPOSITORIES) > 0:
+        return set(config.IMAGE_REPOSITORIES)
+    primary_image = next(iter(images["containers"].values()))
+    return {get_repository(primary_image)}
+
+
+def get_release_image(old_image: str, new_tag: str) -> str:
+    """
+    Retagged image, pinned to the tag's manifest digest when PIN_IMAGE_DIGESTS is set.
+    """
+    new_image = generate_image(old_image=old_image, new_tag=new_tag)
+    if not config.PIN_IMAGE_DIGESTS:
+        return new_image
+    reference = parse_image(new_image)
+    digest = get_manifest_digest(reference)
+    if digest is None:
+        raise Exception("Image Not Found In Registry: image={}".format(new_image))
+    return str(reference.with_digest(digest))
+
+
+def get_release_tags(images: dict, new_tag: str) -> Set[str]:
+    """
+    Unpinned repository:new_tag of every image retag_images moves to the release tag.
+    """
+    repositories = get_retag_repositories(images)
+    return {
+        generate_image(old_image=image, new_tag=new_tag)
+        for containers in images.values()
+        for image in containers.values()
+        if get_repository(image) in repositories
+    }
+
+
+def retag_images(images: dict, new_tag: str) -> dict:
+    """
+    Copy of images with every container whose repository shares the release tag moved to new_tag.
+    """
+    repositories = get_retag_repositories(images)
+    return {
+        field: {
+            name: get_release_image(old_image=image, new_tag=new_tag)
+            if get_repository(image) in repositories
+            else image
+            for name, image in containers.items()
+        }
+        for field, containers in images.items()
+    }
+
+
+def get_changed_images(old_images: dict, new_images: dict) -> dict:
+    return {
+        field: {
+            name: image
+            for name, image in containers.items()
+            if old_images[field].get(name) != image
+        }
+        for field, containers in new_images.items()
+    }
+
+
+def has_images(images: dict) -> bool:
+    return any(len(containers) > 0 for containers in images.values())
+
+
+def pod_spec_images_patch(pod_spec_path: List[str], images: dict) -> dict:
+    """
+    Strategic merge patch setting every given container image in one request, keyed on container names.
+    """
+    patch = {
+        field: [{"name": name, "image": image} for name, image in containers.items()]
+        for field, containers in images.items()
+        if len(containers) > 0
+    }
+    for key in reversed(pod_spec_path):
+        patch = {key: patch}
+    return patch
+
+
+def describe_image_changes(old_images: dict, new_images: dict) -> str:
+    return "\n".join(
+        "container={} old_image={} new_image={}".format(name, old_images[field][name], image)
+        for field, containers in get_changed_images(old_images, new_images).items()
+        for name, image in containers.items()
+    )
+
+
+def describe_images(images: dict) -> str:
+    return "\n".join(
+        "container={} image={}".format(name, image)
+        for containers in images.values()
+        for name, image in containers.items()
+    )
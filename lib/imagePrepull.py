@@ -0,0 +1,72 @@
+import config
+import uuid
+from kubernetes import client
+from typing import List
+
+PREPULL_APP = f"{config.PROJECT}-prepull"
+# waiting reasons that still mean the image isn't on the node yet
+PULLING_REASONS = [None, "", "ContainerCreating", "PodInitializing"]
+PULL_FAILURES = ["ErrImagePull", "ImagePullBackOff", "InvalidImageName"]
+
+
+def generate_prepull_daemon_set(
+    images: List[str], image_pull_secrets: List[str] = ()
+) -> client.V1DaemonSet:
+    """
+    DaemonSet running one idle container per image, so every node pulls every image.
+    """
+    labels = {"app": PREPULL_APP, "prepull-id": uuid.uuid4().hex[:12]}
+    containers = [
+        client.V1Container(
+            name="prepull-{}".format(index),
+            image=image,
+            command=config.PREPULL_COMMAND,
+            resources=client.V1ResourceRequirements(
+                requests={"cpu": "1m", "memory": "8Mi"}
+            ),
+        )
+        for index, image in enumerate(images)
+    ]
+    return client.V1DaemonSet(
+        api_version="apps/v1",
+        kind="DaemonSet",
+        metadata=client.V1ObjectMeta(generate_name="{}-".format(PREPULL_APP), labels=labels),
+        spec=client.V1DaemonSetSpec(
+            selector=client.V1LabelSelector(match_labels=labels),
+            template=client.V1PodTemplateSpec(
+                metadata=client.V1ObjectMeta(labels=labels),
+                spec=client.V1PodSpec(
+                    containers=containers,
+                    image_pull_secrets=[
+                        client.V1LocalObjectReference(name=name) for name in image_pull_secrets
+                    ],
+                    termination_grace_period_seconds=0,
+                    tolerations=[client.V1Toleration(operator="Exists")],
+                ),
+            ),
+        ),
+    )
+
+
+def get_pull_failure(pod) -> str:
+    for status in pod.status.container_statuses or []:
+        waiting = status.state.waiting if status.state is not None else None
+        if waiting is not None and waiting.reason in PULL_FAILURES:
+            return "node={} image={} reason={} message={}".format(
+                pod.spec.node_name, status.image, waiting.reason, waiting.message
+            )
+    return None
+
+
+def is_pulled(pod, image_count: int) -> bool:
+    """
+    True once every container got past pulling its image, whether or not it then started.
+    """
+    statuses = pod.status.container_statuses or []
+    if len(statuses) < image_count:
+        return False
+    for status in statuses:
+        waiting = status.state.waiting if status.state is not None else None
+        if status.state is None or (waiting is not None and waiting.reason in PULLING_REASONS):
+            return False
+    return True
@@ -0,0 +1,83 @@
+from functools import lru_cache
+from typing import NamedTuple
+
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_ALIASES = (DOCKER_HUB, "index.docker.io")
+DOCKER_HUB_API = "registry-1.docker.io"
+
+
+class ImageReference(NamedTuple):
+    """
+    Parsed container image reference: [registry/]repository[:tag][@digest]
+    """
+
+    registry: str
+    repository: str
+    tag: str
+    digest: str
+
+    @property
+    def name(self) -> str:
+        if self.registry is None:
+            return self.repository
+        return "{}/{}".format(self.registry, self.repository)
+
+    def with_tag(self, tag: str) -> "ImageReference":
+        return self._replace(tag=tag, digest=None)
+
+    def with_digest(self, digest: str) -> "ImageReference":
+        return self._replace(digest=digest)
+
+    def __str__(self) -> str:
+        image = self.name
+        if self.tag is not None:
+            image += ":{}".format(self.tag)
+        if self.digest is not None:
+            image += "@{}".format(self.digest)
+        return image
+
+
+def is_registry(component: str) -> bool:
+    return "." in component or ":" in component or component == "localhost"
+
+
+@lru_cache(maxsize=None)
+def parse_image(image: str) -> ImageReference:
+    """
+    Split an image reference into registry, repository, tag and digest.
+    The registry port and the digest algorithm are never mistaken for a tag.
+    """
+    name, _, digest = image.partition("@")
+    last_component = name.rsplit("/", 1)[-1]
+    tag = None
+    if ":" in last_component:
+        name, tag = name.rsplit(":", 1)
+    registry = None
+    first_component, slash, rest = name.partition("/")
+    if slash and is_registry(first_component):
+        registry, name = first_component, rest
+    if name == "":
+        raise ValueError("Invalid image reference: image={}".format(image))
+    return ImageReference(registry, name, tag, digest or None)
+
+
+def is_docker_hub(reference: ImageReference) -> bool:
+    return reference.registry is None or reference.registry in DOCKER_HUB_ALIASES
+
+
+def get_registry_host(reference: ImageReference) -> str:
+    """
+    Host serving the registry v2 api, Docker Hub's api isn't on docker.io itself.
+    """
+    if is_docker_hub(reference):
+        return DOCKER_HUB_API
+    return reference.registry
+
+
+def get_registry_repository(reference: ImageReference) -> str:
+    """
+    Repository path as the registry API expects it, including Docker Hub's implicit library/.
+    """
+    if is_docker_hub(reference) and "/" not in reference.repository:
+        return "library/{}".format(reference.repository)
+    return reference.repository
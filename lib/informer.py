@@ -0,0 +1,171 @@
+import logging
+import time
+from kubernetes import client
+from threading import Condition, Lock, Thread
+from lib.kubeWatch import GONE, WATCH_TIMEOUT_SECONDS, ResourceWatch, WatchExpired
+from lib.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+# index of items by the uids of their owners (ReplicaSets by deployment, pods by ReplicaSet or job)
+OWNER_INDEX = "owner"
+
+
+def format_label_selector(labels: dict) -> str:
+    return ",".join("{}={}".format(key, value) for key, value in labels.items())
+
+
+def matches_labels(item, labels: dict) -> bool:
+    item_labels = item.metadata.labels or {}
+    return all(item_labels.get(key) == value for key, value in labels.items())
+
+
+def get_owner_uids(item) -> list:
+    return [owner.uid for owner in item.metadata.owner_references or []]
+
+
+class Informer(ResourceWatch):
+    """
+    Shared local cache of one resource type in the namespace, listed once and kept current
+    by a watch on a background thread, so checks become in-memory lookups.
+    Indexes map keys from each item (e.g. owner uid) to items; handlers are called with
+    (event type, item) after every watch event.
+    """
+
+    def __init__(self, list_func, namespace: str, poll_wait: float, **list_kwargs):
+        super().__init__(list_func, namespace, poll_wait, **list_kwargs)
+        self.condition = Condition()
+        self.start_lock = Lock()
+        self.thread = None
+        self.indexers = {}
+        self.indexes = {}
+        self.handlers = []
+
+    def add_index(self, name: str, key_func):
+        """
+        Index items by every key key_func(item) returns. Add indexes before start().
+        """
+        self.indexers[name] = key_func
+        self.indexes[name] = {}
+
+    def add_handler(self, handler):
+        with self.condition:
+            self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        with self.condition:
+            self.handlers.remove(handler)
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.relist()
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def get(self, name: str):
+        with self.condition:
+            return self.objects.get(name)
+
+    def items(self, labels: dict = None, index: str = None, key: str = None) -> list:
+        """
+        Cached items, optionally only those under key in index and matching labels.
+        """
+        with self.condition:
+            if index is None:
+                items = self.objects.values()
+            else:
+                items = self.indexes[index].get(key, {}).values()
+            return [item for item in items if labels is None or matches_labels(item, labels)]
+
+    def index_item(self, item):
+        for name, key_func in self.indexers.items():
+            for key in key_func(item):
+                self.indexes[name].setdefault(key, {})[item.metadata.name] = item
+
+    def unindex_item(self, item):
+        for name, key_func in self.indexers.items():
+            for key in key_func(item):
+                self.indexes[name].get(key, {}).pop(item.metadata.name, None)
+
+    def relist(self):
+        response = self.list_func(self.namespace, **self.list_kwargs)
+        with self.condition:
+            self.objects = {item.metadata.name: item for item in response.items}
+            self.resource_version = response.metadata.resource_version
+            self.indexes = {name: {} for name in self.indexers}
+            for item in self.objects.values():
+                self.index_item(item)
+            self.condition.notify_all()
+
+    def apply_event(self, event: dict):
+        with self.condition:
+            name = event["object"].metadata.name if event["type"] != "ERROR" else None
+            previous = self.objects.get(name)
+            super().apply_event(event)
+            if previous is not None:
+                self.unindex_item(previous)
+            if name in self.objects:
+                self.index_item(self.objects[name])
+            handlers = list(self.handlers)
+            self.condition.notify_all()
+        for handler in handlers:
+            try:
+                handler(event["type"], event["object"])
+            except Exception as e:
+                log.warning("Informer handler failed: error={}".format(str(e)))
+
+    def run(self):
+        while True:
+            try:
+                for _ in self.watch(WATCH_TIMEOUT_SECONDS):
+                    self.backoff.reset()
+            except WatchExpired:
+                self.handle_expired()
+            except client.rest.ApiException as e:
+                if e.status == GONE:
+                    self.handle_expired()
+                else:
+                    self.recover(e)
+            except Exception as e:
+                self.recover(e)
+
+    def handle_expired(self):
+        log.debug(
+            "Informer watch expired, relisting: resource_version={}".format(self.resource_version)
+        )
+        self.try_relist()
+
+    def recover(self, error: Exception):
+        log.warning("Informer watch dropped, relisting: error={}".format(str(error)))
+        tracer.sleep(self.backoff.next())
+        self.try_relist()
+
+    def try_relist(self):
+        """
+        Relist, backing off when it fails instead of raising, so the watch thread never exits
+        and the next watch retries from the stale resourceVersion.
+        """
+        try:
+            self.relist()
+        except Exception as e:
+            log.warning("Informer relist failed: error={}".format(str(e)))
+            tracer.sleep(self.backoff.next())
+
+    def wait_until(
+        self, condition, timeout: float, labels: dict = None, index: str = None, key: str = None
+    ) -> bool:
+        """
+        Block until condition(items) is true for the cached items selected as in items().
+        Returns False if the timeout passes first.
+        """
+        self.start()
+        timeout_time = time.time() + timeout
+        with self.condition:
+            while not condition(self.items(labels, index, key)):
+                remaining = timeout_time - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
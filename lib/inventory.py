@@ -0,0 +1,61 @@
+import logging
+from typing import List
+from lib.kubeApi import KubeApi
+
+log = logging.getLogger(__name__)
+
+
+class Inventory:
+    """
+    Project deployments and cronjobs, fetched with one LIST each and cached for the run
+    """
+
+    def __init__(self, kuber: KubeApi, project: str, tiers: List[str]):
+        self.kuber = kuber
+        self.label_selector = "project={}".format(project)
+        self.tiers = tiers
+        self.deployments = None
+        self.untiered = None
+        self.cronjobs = None
+
+    def get_deployments(self) -> dict:
+        """
+        Deployments partitioned by tier label, in TIERS order.
+        """
+        if self.deployments is None:
+            self.deployments = {tier: [] for tier in self.tiers}
+            self.untiered = []
+            for deployment in self.kuber.get_deployments(label_selector=self.label_selector):
+                self.deployments.get(deployment["tier"], self.untiered).append(deployment)
+            for deployment in self.untiered:
+                log.warning(
+                    "Deployment tier not listed in TIERS: deployment={} tier={}".format(
+                        deployment["name"], deployment["tier"]
+                    )
+                )
+        return self.deployments
+
+    def get_untiered_deployments(self) -> List[dict]:
+        """
+        Project deployments whose tier label isn't listed in TIERS and will not be deployed.
+        """
+        self.get_deployments()
+        return self.untiered
+
+    def get_image_pull_secrets(self) -> List[str]:
+        """
+        Every image pull secret the tiered deployments' pods authenticate with.
+        """
+        return sorted(
+            {
+                secret
+                for deployments in self.get_deployments().values()
+                for deployment in deployments
+                for secret in deployment["image_pull_secrets"]
+            }
+        )
+
+    def get_cronjobs(self) -> List[dict]:
+        if self.cronjobs is None:
+            self.cronjobs = self.kuber.get_cronjobs(label_selector=self.label_selector)
+        return self.cronjobs
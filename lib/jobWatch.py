@@ -0,0 +1,128 @@
+import logging
+from collections import deque
+from threading import Lock, Thread
+from typing import List
+from lib.informer import OWNER_INDEX, Informer, get_owner_uids
+
+log = logging.getLogger(__name__)
+
+LOG_JOIN_SECONDS = 5
+# container waiting reasons that won't resolve without a new pod spec or image
+WAITING_FAILURES = [
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "InvalidImageName",
+    "CrashLoopBackOff",
+    "CreateContainerConfigError",
+    "CreateContainerError",
+]
+
+
+def get_container_statuses(pod) -> list:
+    return (pod.status.init_container_statuses or []) + (pod.status.container_statuses or [])
+
+
+def get_pod_failure(pod) -> str:
+    """
+    Describe why a job pod can no longer succeed, or None while it still can.
+    """
+    if pod.status.phase == "Failed":
+        return "pod={} phase=Failed reason={}".format(pod.metadata.name, pod.status.reason)
+    for status in get_container_statuses(pod):
+        if status.state is None:
+            continue
+        waiting = status.state.waiting
+        if waiting is not None and waiting.reason in WAITING_FAILURES:
+            return "pod={} container={} reason={} message={}".format(
+                pod.metadata.name, status.name, waiting.reason, waiting.message
+            )
+        terminated = status.state.terminated
+        if terminated is not None and (
+            terminated.reason == "OOMKilled" or terminated.exit_code != 0
+        ):
+            return "pod={} container={} reason={} exit_code={}".format(
+                pod.metadata.name, status.name, terminated.reason, terminated.exit_code
+            )
+    return None
+
+
+def has_started(pod, container: str) -> bool:
+    for status in pod.status.container_statuses or []:
+        if status.name == container and status.state is not None:
+            return status.state.running is not None or status.state.terminated is not None
+    return False
+
+
+class JobSupervisor:
+    """
+    Follows a job's pods until one succeeds or fails, streaming the job container's logs.
+    Pods are found by the job's uid through the pods informer's owner index.
+    """
+
+    def __init__(self, core_api, pods: Informer, namespace: str, job, log_lines: int):
+        self.core_api = core_api
+        self.pods = pods
+        self.namespace = namespace
+        self.job = job.metadata.name
+        self.job_uid = job.metadata.uid
+        self.stream_lock = Lock()
+        self.log_tail = deque(maxlen=log_lines)
+        self.log_streams = {}
+        self.failure = None
+
+    def get_log_tail(self) -> List[str]:
+        return list(self.log_tail)
+
+    def on_pod_event(self, event_type: str, pod):
+        if event_type != "DELETED" and self.job_uid in get_owner_uids(pod):
+            self.stream_logs(pod)
+
+    def check_pods(self, pods: list) -> bool:
+        for pod in pods:
+            failure = get_pod_failure(pod)
+            if failure is not None:
+                self.failure = failure
+                return True
+        return any(pod.status.phase == "Succeeded" for pod in pods)
+
+    def wait(self, timeout: float):
+        """
+        Block until the job succeeds. Raises as soon as a pod hits a terminal failure.
+        """
+        self.pods.add_handler(self.on_pod_event)
+        try:
+            for pod in self.pods.items(index=OWNER_INDEX, key=self.job_uid):
+                self.stream_logs(pod)
+            finished = self.pods.wait_until(
+                self.check_pods, timeout, index=OWNER_INDEX, key=self.job_uid
+            )
+        finally:
+            self.pods.remove_handler(self.on_pod_event)
+        for stream in self.log_streams.values():
+            stream.join(LOG_JOIN_SECONDS)
+        if not finished:
+            raise Exception("Job Termination Timeout Exceeded: job={}".format(self.job))
+        if self.failure is not None:
+            raise Exception("Job Failed: job={} {}".format(self.job, self.failure))
+
+    def stream_logs(self, pod):
+        name = pod.metadata.name
+        container = pod.spec.containers[0].name
+        with self.stream_lock:
+            if name in self.log_streams or not has_started(pod, container):
+                return
+            stream = Thread(target=self.follow_logs, args=(name, container), daemon=True)
+            self.log_streams[name] = stream
+        stream.start()
+
+    def follow_logs(self, pod: str, container: str):
+        try:
+            response = self.core_api.read_namespaced_pod_log(
+                pod, self.namespace, container=container, follow=True, _preload_content=False
+            )
+            for line in response:
+                text = line.decode("utf-8", errors="replace").rstrip("\n")
+                log.info("[{}] {}".format(pod, text))
+                self.log_tail.append(text)
+        except Exception as error:
+            log.warning("Stopped streaming job logs: pod={} error={}".format(pod, error))
@@ -1,20 +1,129 @@
 import config
+import copy
 import logging
 import time
 from kubernetes import client, config as kube_config
+from threading import Lock
 from typing import List
-from lib.helpers import generate_image
+from lib.canary import get_canary_failure, is_pod_ready
+from lib.imageMap import (
+    CONTAINER_FIELDS,
+    get_pod_spec_images,
+    pod_spec_images_patch,
+    retag_images,
+)
+from lib.imagePrepull import (
+    PREPULL_APP,
+    generate_prepull_daemon_set,
+    get_pull_failure,
+    is_pulled,
+)
+from lib.informer import OWNER_INDEX, Informer, format_label_selector, get_owner_uids
+from lib.jobWatch import JobSupervisor
+from lib.kubeWatch import ResourceWatch
+from lib.tracing import tracer
 
 log = logging.getLogger(__name__)
 TIMEOUT_SECONDS = 300
 POLL_WAIT = 15
 NOT_FOUND = 404
+ALREADY_EXISTS = 409
 APP_MIGRATOR = f"{config.PROJECT}-migrator"
+DEPLOYMENT_POD_SPEC_PATH = ["spec", "template", "spec"]
+CRONJOB_POD_SPEC_PATH = ["spec", "jobTemplate", "spec", "template", "spec"]
+POD_TEMPLATE_HASH_LABEL = "pod-template-hash"
+REVISION_ANNOTATION = "deployment.kubernetes.io/revision"
+FINISHED_POD_PHASES = ["Succeeded", "Failed"]
+DEPLOYMENT_PATH = "/apis/apps/v1/namespaces/{namespace}/deployments/{name}"
+CRONJOB_PATH = "/apis/batch/v1beta1/namespaces/{namespace}/cronjobs/{name}"
+JOBS_PATH = "/apis/batch/v1/namespaces/{namespace}/jobs"
+DEPLOYMENTS = "deployments"
+REPLICA_SETS = "replica_sets"
+PODS = "pods"
+JOBS = "jobs"
+PROJECT_LABELS = {"project": config.PROJECT}
 
-if config.DEBUG:
-    kube_config.load_kube_config()
-else:
-    kube_config.load_incluster_config()
+default_config_lock = Lock()
+default_config_loaded = False
+
+
+def load_default_config():
+    """
+    Authorize the default api client with local kube config when DEBUG, in-cluster otherwise.
+    """
+    global default_config_loaded
+    with default_config_lock:
+        if default_config_loaded:
+            return
+        if config.DEBUG:
+            kube_config.load_kube_config()
+        else:
+            kube_config.load_incluster_config()
+        default_config_loaded = True
+
+
+def create_api_client(context: str = None) -> client.ApiClient:
+    """
+    Api client for a kube config context, or the default client when no context is given.
+    """
+    if context:
+        return kube_config.new_client_from_config(context=context, persist_config=False)
+    load_default_config()
+    return client.ApiClient()
+
+
+def get_rollout_spec(deployment: client.V1Deployment) -> dict:
+    strategy = deployment.spec.strategy
+    rolling_update = strategy.rolling_update if strategy is not None else None
+    has_rolling_update = rolling_update is not None
+    return {
+        "strategy": strategy.type if strategy is not None else None,
+        "max_surge": rolling_update.max_surge if has_rolling_update else None,
+        "max_unavailable": rolling_update.max_unavailable if has_rolling_update else None,
+        "progress_deadline_seconds": deployment.spec.progress_deadline_seconds,
+        "termination_grace_seconds": (
+            deployment.spec.template.spec.termination_grace_period_seconds
+        ),
+    }
+
+
+def is_progress_deadline_exceeded(deployment: client.V1Deployment) -> bool:
+    return any(
+        condition.type == "Progressing" and condition.reason == "ProgressDeadlineExceeded"
+        for condition in deployment.status.conditions or []
+    )
+
+
+def is_generation_observed(deployment: client.V1Deployment, generation: int) -> bool:
+    """
+    True once the deployment controller has seen the spec change that produced generation.
+    """
+    if generation is None:
+        return True
+    return (deployment.status.observed_generation or 0) >= generation
+
+
+def is_current_pod(pod: client.V1Pod, pod_template_hash: str) -> bool:
+    """
+    True for a pod that isn't terminating and, when the hash is known, belongs to the current
+    ReplicaSet. Finished pods (e.g. evicted) never block a rollout and are ignored.
+    """
+    if pod.status.phase in FINISHED_POD_PHASES:
+        return True
+    if pod.metadata.deletion_timestamp is not None:
+        return False
+    if pod_template_hash is None:
+        return True
+    return (pod.metadata.labels or {}).get(POD_TEMPLATE_HASH_LABEL) == pod_template_hash
+
+
+def is_deployment_updated(deployment: client.V1Deployment) -> bool:
+    status = deployment.status
+    desired_replicas = status.replicas
+    all_pods_updated = desired_replicas == status.updated_replicas
+    all_pods_available = desired_replicas == status.available_replicas
+    no_pods_unavailable = status.unavailable_replicas is None
+    return all_pods_updated and all_pods_available and no_pods_unavailable
 
 
 class KubeApi:
@@ -22,13 +131,59 @@ class KubeApi:
     Wrapper for kubernetes client
     """
 
-    def __init__(self, namespace: str):
+    def __init__(self, namespace: str, api_client: client.ApiClient = None):
+        if api_client is None:
+            api_client = create_api_client()
         self.client = client
-        self.appsV1Api = client.AppsV1Api()
-        self.coreV1Api = client.CoreV1Api()
-        self.batchV1Api = client.BatchV1Api()
+        self.api_client = api_client
+        self.appsV1Api = tracer.instrument(client.AppsV1Api(api_client))
+        self.coreV1Api = tracer.instrument(client.CoreV1Api(api_client))
+        self.batchV1Api = tracer.instrument(client.BatchV1Api(api_client))
         self.namespace = namespace
-        self.batchV1beta1Api = client.BatchV1beta1Api()
+        self.batchV1beta1Api = tracer.instrument(client.BatchV1beta1Api(api_client))
+        self.informer_lock = Lock()
+        self.informers = {}
+
+    def create_informer(self, kind: str) -> Informer:
+        project_selector = format_label_selector(PROJECT_LABELS)
+        if kind == DEPLOYMENTS:
+            return Informer(
+                self.appsV1Api.list_namespaced_deployment,
+                self.namespace,
+                POLL_WAIT,
+                label_selector=project_selector,
+            )
+        if kind == JOBS:
+            return Informer(
+                self.batchV1Api.list_namespaced_job,
+                self.namespace,
+                POLL_WAIT,
+                label_selector=project_selector,
+            )
+        # pod templates aren't required to carry the project label, so replica sets and
+        # pods are cached for the whole namespace
+        if kind == REPLICA_SETS:
+            informer = Informer(
+                self.appsV1Api.list_namespaced_replica_set, self.namespace, POLL_WAIT
+            )
+            informer.add_index(OWNER_INDEX, get_owner_uids)
+            return informer
+        if kind == PODS:
+            informer = Informer(self.coreV1Api.list_namespaced_pod, self.namespace, POLL_WAIT)
+            informer.add_index(OWNER_INDEX, get_owner_uids)
+            return informer
+        raise ValueError("Unknown informer kind: kind={}".format(kind))
+
+    def get_informer(self, kind: str) -> Informer:
+        """
+        Namespace cache of one resource kind, shared by every concurrent read and wait.
+        """
+        with self.informer_lock:
+            if kind not in self.informers:
+                self.informers[kind] = self.create_informer(kind)
+            informer = self.informers[kind]
+        informer.start()
+        return informer
 
     def get_deployments(self, label_selector: str) -> List[dict]:
         log.debug("Getting deployments: label_selector={}".format(label_selector))
@@ -41,8 +196,15 @@ class KubeApi:
             deployments.append(
                 {
                     "name": deployment.metadata.name,
-                    "image": deployment.spec.template.spec.containers[0].image,
+                    "tier": (deployment.metadata.labels or {}).get("tier"),
+                    "images": get_pod_spec_images(deployment.spec.template.spec),
                     "replicas": deployment.status.replicas,
+                    "annotations": deployment.metadata.annotations or {},
+                    "rollout": get_rollout_spec(deployment),
+                    "image_pull_secrets": [
+                        secret.name
+                        for secret in deployment.spec.template.spec.image_pull_secrets or []
+                    ],
                 }
             )
         log.debug(
@@ -62,7 +224,7 @@ class KubeApi:
             cronjobs.append(
                 {
                     "name": cronjob.metadata.name,
-                    "image": cronjob.spec.job_template.spec.template.spec.containers[0].image,
+                    "images": get_pod_spec_images(cronjob.spec.job_template.spec.template.spec),
                 }
             )
         log.debug(
@@ -72,114 +234,375 @@ class KubeApi:
         )
         return cronjobs
 
+    def dry_run(self, method: str, path: str, body, response_type: str, name: str = None):
+        """
+        Send a mutating request with dryRun=All, so it passes validation and admission
+        without being persisted. kubernetes==8.0.1 has no dry_run argument, so the request
+        is made through the api client directly.
+        """
+        content_type = "application/json"
+        if method == "PATCH":
+            content_type = "application/strategic-merge-patch+json"
+        path_params = {"namespace": self.namespace}
+        if name is not None:
+            path_params["name"] = name
+        return self.api_client.call_api(
+            path,
+            method,
+            path_params=path_params,
+            query_params=[("dryRun", "All")],
+            header_params={"Accept": "application/json", "Content-Type": content_type},
+            body=body,
+            response_type=response_type,
+            auth_settings=["BearerToken"],
+            _return_http_data_only=True,
+        )
+
     def update_deployment(
-        self, deployment: client.V1Deployment, verify_update: bool = True
-    ):
-        name = deployment.metadata.name
+        self, name: str, patch, verify_update: bool = True, dry_run: bool = False
+    ) -> int:
+        """
+        Patch a deployment and return the generation the patch produced.
+        A dry run only checks the patch against the api server and returns None.
+        """
+        if dry_run:
+            log.debug("Dry run deployment update: deployment={} update={}".format(name, patch))
+            self.dry_run("PATCH", DEPLOYMENT_PATH, patch, "V1Deployment", name=name)
+            return None
         log.debug(
-            "Updating deployment: deployment={} update={}".format(name, deployment)
+            "Updating deployment: deployment={} update={}".format(name, patch)
         )
         deployment = self.appsV1Api.patch_namespaced_deployment(
-            name, self.namespace, deployment
+            name, self.namespace, patch
         )
+        generation = deployment.metadata.generation
         if verify_update:
-            self.verify_deployment_update(name)
+            self.verify_deployment_update(name, generation=generation)
         log.debug(
-            "Finished updating deployment: deployment={} update={}".format(
-                name, deployment
+            "Finished updating deployment: deployment={} generation={}".format(
+                name, generation
             )
         )
+        return generation
 
-    def update_cronjob(self, cronjob):
-        name = cronjob.metadata.name
+    def update_cronjob(self, name: str, patch, dry_run: bool = False):
+        if dry_run:
+            log.debug("Dry run cronjob update: cronjob={} update={}".format(name, patch))
+            self.dry_run("PATCH", CRONJOB_PATH, patch, "V1beta1CronJob", name=name)
+            return
         log.debug(
-            "Updating cronjob: cronjob={} update={}".format(name, cronjob)
+            "Updating cronjob: cronjob={} update={}".format(name, patch)
         )
         cronjob = self.batchV1beta1Api.patch_namespaced_cron_job(
-            name, self.namespace, cronjob
+            name, self.namespace, patch
         )
         log.debug(
-            "Finished updating cronjob: cronjob={} update={}".format(
-                name, cronjob
+            "Finished updating cronjob: cronjob={} generation={}".format(
+                name, cronjob.metadata.generation
             )
         )
 
     def set_deployment_replicas(
-        self, name: str, replicas: int, verify_update: bool = False
-    ):
-        deployment = self.appsV1Api.read_namespaced_deployment(name, self.namespace)
-        deployment.spec.replicas = replicas
-        self.update_deployment(deployment, verify_update)
+        self, name: str, replicas: int, verify_update: bool = False, dry_run: bool = False
+    ) -> int:
+        log.debug(
+            "Scaling deployment: deployment={} replicas={}".format(name, replicas)
+        )
+        return self.update_deployment(
+            name, {"spec": {"replicas": replicas}}, verify_update, dry_run
+        )
 
-    def set_deployment_image(self, name: str, image: str, verify_update: bool = False):
-        deployment = self.appsV1Api.read_namespaced_deployment(name, self.namespace)
-        deployment.spec.template.spec.containers[0].image = image
-        self.update_deployment(deployment, verify_update)
+    def set_deployment_images(
+        self, name: str, images: dict, verify_update: bool = False, dry_run: bool = False
+    ) -> int:
+        patch = pod_spec_images_patch(DEPLOYMENT_POD_SPEC_PATH, images)
+        return self.update_deployment(name, patch, verify_update, dry_run)
 
-    def set_cronjob_image(self, name: str, image: str, verify_update: bool = False):
-        cronjob = self.batchV1beta1Api.read_namespaced_cron_job(name, self.namespace)
-        cronjob.spec.job_template.spec.template.spec.containers[0].image = image
-        self.update_cronjob(cronjob)
+    def set_cronjob_images(self, name: str, images: dict, dry_run: bool = False):
+        patch = pod_spec_images_patch(CRONJOB_POD_SPEC_PATH, images)
+        self.update_cronjob(name, patch, dry_run)
 
-    def verify_deployment_update(self, deployment: str):
-        self.verify_pod_updates_complete(deployment)
-        self.verify_pod_terminations_complete(deployment)
+    def start_canary(self, name: str, images: dict, canary_pods: int) -> int:
+        """
+        Patch images with a surge of canary_pods and no unavailable pods, then pause the rollout
+        once the controller has scaled up the new ReplicaSet, so old pods keep serving.
+        """
+        patch = pod_spec_images_patch(DEPLOYMENT_POD_SPEC_PATH, images)
+        patch["spec"]["strategy"] = {
+            "rollingUpdate": {"maxSurge": canary_pods, "maxUnavailable": 0}
+        }
+        generation = self.update_deployment(name, patch, verify_update=False)
+        if not self.wait_generation_observed(name, generation, TIMEOUT_SECONDS):
+            raise Exception("Canary Rollout Not Observed: deployment={}".format(name))
+        return self.update_deployment(name, {"spec": {"paused": True}}, verify_update=False)
 
-    def verify_pod_updates_complete(self, deployment: str):
-        log.debug("Verifying pod updates complete: deployment={}".format(deployment))
-        timeout_time = time.time() + TIMEOUT_SECONDS
-        still_updating = True
-        while time.time() < timeout_time and still_updating:
-            log.debug(
-                "Checking deployment replica status: deployment={}".format(deployment)
+    def wait_generation_observed(self, name: str, generation: int, timeout: float) -> bool:
+        """
+        Wait for the deployment controller to act on a change, so it treats the patched
+        template as the new ReplicaSet.
+        """
+        deployments = self.get_informer(DEPLOYMENTS)
+        return deployments.wait_until(
+            lambda _: deployments.get(name) is not None
+            and is_generation_observed(deployments.get(name), generation),
+            timeout,
+        )
+
+    def resume_rollout(self, name: str, rollout: dict) -> int:
+        """
+        Unpause a canary and restore the deployment's own maxSurge / maxUnavailable.
+        """
+        return self.update_deployment(
+            name,
+            {
+                "spec": {
+                    "paused": False,
+                    "strategy": {
+                        "rollingUpdate": {
+                            "maxSurge": rollout["max_surge"],
+                            "maxUnavailable": rollout["max_unavailable"],
+                        }
+                    },
+                }
+            },
+            verify_update=False,
+        )
+
+    def verify_canary(
+        self,
+        name: str,
+        canary_pods: int,
+        bake_seconds: float,
+        max_restarts: int,
+        probe=None,
+        timeout: float = TIMEOUT_SECONDS,
+    ):
+        """
+        Wait for canary_pods pods of the new ReplicaSet to become ready, then keep them under
+        watch for bake_seconds: any restart over max_restarts, pull or crash loop, lost
+        readiness or failed probe(name) fails the canary.
+        """
+        log.debug("Verifying canary: deployment={} pods={}".format(name, canary_pods))
+        replica_set = self.get_current_replica_set(
+            self.get_informer(DEPLOYMENTS).get(name), timeout
+        )
+        if replica_set is None:
+            raise Exception("Canary ReplicaSet Not Found: deployment={}".format(name))
+        pods = self.get_informer(PODS)
+        failures = []
+
+        def find_failures(items: list, require_ready: bool) -> bool:
+            failures.extend(
+                failure
+                for failure in (
+                    get_canary_failure(pod, max_restarts, require_ready) for pod in items
+                )
+                if failure is not None
             )
-            result = self.appsV1Api.read_namespaced_deployment(
-                deployment, self.namespace
+            return len(failures) > 0
+
+        ready = pods.wait_until(
+            lambda items: find_failures(items, require_ready=False)
+            or sum(is_pod_ready(pod) for pod in items) >= canary_pods,
+            timeout,
+            index=OWNER_INDEX,
+            key=replica_set.metadata.uid,
+        )
+        if not ready:
+            raise Exception("Canary Ready Timeout Exceeded: deployment={}".format(name))
+        bake_time = time.time() + bake_seconds
+        while len(failures) == 0 and time.time() < bake_time:
+            pods.wait_until(
+                lambda items: find_failures(items, require_ready=True),
+                min(config.CANARY_PROBE_SECONDS, max(0, bake_time - time.time())),
+                index=OWNER_INDEX,
+                key=replica_set.metadata.uid,
             )
-            status = result.status
-            desired_replicas = status.replicas
-            all_pods_updated = desired_replicas == status.updated_replicas
-            all_pods_available = desired_replicas == status.available_replicas
-            no_pods_unavailable = status.unavailable_replicas is None
-            still_updating = not (
-                all_pods_updated and all_pods_available and no_pods_unavailable
+            failure = probe(name) if probe is not None and len(failures) == 0 else None
+            if failure is not None:
+                failures.append(failure)
+        if len(failures) > 0:
+            raise Exception(
+                "Canary Failed: deployment={} {}".format(name, "\n".join(sorted(set(failures))))
             )
-            if still_updating:
-                time.sleep(POLL_WAIT)
+        log.debug("Canary passed: deployment={}".format(name))
+
+    def annotate_deployment(self, name: str, annotations: dict):
+        log.debug(
+            "Annotating deployment: deployment={} annotations={}".format(name, annotations)
+        )
+        self.appsV1Api.patch_namespaced_deployment(
+            name, self.namespace, {"metadata": {"annotations": annotations}}
+        )
 
-        if still_updating:
+    def verify_deployment_update(
+        self,
+        deployment: str,
+        generation: int = None,
+        timeout: float = TIMEOUT_SECONDS,
+        termination_timeout: float = TIMEOUT_SECONDS,
+    ):
+        with tracer.span("verify_deployment_update", deployment=deployment):
+            updated = self.verify_pod_updates_complete(deployment, generation, timeout)
+            self.verify_deployment_pods_current(updated, termination_timeout)
+
+    def verify_pod_updates_complete(
+        self, deployment: str, generation: int = None, timeout: float = TIMEOUT_SECONDS
+    ) -> client.V1Deployment:
+        log.debug("Verifying pod updates complete: deployment={}".format(deployment))
+        deployments = self.get_informer(DEPLOYMENTS)
+
+        def is_settled(_) -> bool:
+            item = deployments.get(deployment)
+            return (
+                item is not None
+                and is_generation_observed(item, generation)
+                and (is_deployment_updated(item) or is_progress_deadline_exceeded(item))
+            )
+
+        updated = deployments.wait_until(is_settled, timeout)
+        if updated and is_progress_deadline_exceeded(deployments.get(deployment)):
+            raise Exception(
+                "Deployment Progress Deadline Exceeded: deployment={}".format(deployment)
+            )
+        if not updated:
             raise Exception(
                 "Deployment Update Timeout Exceeded: deployment={}".format(deployment)
             )
         log.debug("Pod updates completed: deployment={}".format(deployment))
+        return deployments.get(deployment)
 
-    def verify_pod_terminations_complete(self, app: str):
-        log.debug("Verifying pod terminations complete: app={}".format(app))
-        timeout_time = time.time() + TIMEOUT_SECONDS
-        still_updating = True
-        while time.time() < timeout_time and still_updating:
-            log.debug("Checking pod status: app={}".format(app))
-            result = self.coreV1Api.list_namespaced_pod(
-                self.namespace, label_selector="app={}".format(app)
-            )
-            still_updating = not all(
-                pod.metadata.deletion_timestamp is None for pod in result.items
+    def get_current_replica_set(
+        self, deployment: client.V1Deployment, timeout: float = TIMEOUT_SECONDS
+    ) -> client.V1ReplicaSet:
+        """
+        The deployment's ReplicaSet for its current revision, waiting for the cache to
+        catch up, or None if it can't be found.
+        """
+        revision = (deployment.metadata.annotations or {}).get(REVISION_ANNOTATION)
+        if revision is None:
+            return None
+        replica_sets = self.get_informer(REPLICA_SETS)
+
+        def find_current(items: list) -> client.V1ReplicaSet:
+            return next(
+                (
+                    item
+                    for item in items
+                    if (item.metadata.annotations or {}).get(REVISION_ANNOTATION) == revision
+                ),
+                None,
             )
-            if still_updating:
-                time.sleep(POLL_WAIT)
 
-        if still_updating:
+        replica_sets.wait_until(
+            lambda items: find_current(items) is not None,
+            timeout,
+            index=OWNER_INDEX,
+            key=deployment.metadata.uid,
+        )
+        return find_current(replica_sets.items(index=OWNER_INDEX, key=deployment.metadata.uid))
+
+    def get_current_replica_set_name(self, name: str) -> str:
+        """
+        Name of the deployment's current ReplicaSet, recorded before a change so a rollback can
+        restore it.
+        """
+        deployment = self.get_informer(DEPLOYMENTS).get(name)
+        if deployment is None:
+            return None
+        replica_set = self.get_current_replica_set(deployment, POLL_WAIT)
+        return replica_set.metadata.name if replica_set is not None else None
+
+    def restore_replica_set(self, name: str, replica_set_name: str) -> int:
+        """
+        Put a previous ReplicaSet's pod template back on the deployment, as kubectl rollout
+        undo does, and scale that ReplicaSet straight to the deployment's replicas instead of
+        waiting for surge steps. Its pods may still be running from the interrupted rollout.
+        The scale waits until the controller has observed the restored template, otherwise it
+        still sees the failed ReplicaSet as new and scales the restored one back down.
+        Returns the generation the rollback produced, or None when the ReplicaSet is gone.
+        """
+        replica_set = self.get_informer(REPLICA_SETS).get(replica_set_name)
+        if replica_set is None:
+            return None
+        log.debug(
+            "Restoring replica set: deployment={} replica_set={}".format(name, replica_set_name)
+        )
+        template = copy.deepcopy(replica_set.spec.template)
+        template.metadata.labels.pop(POD_TEMPLATE_HASH_LABEL, None)
+        deployment = self.appsV1Api.patch_namespaced_deployment(
+            name,
+            self.namespace,
+            [
+                {
+                    "op": "replace",
+                    "path": "/spec/template",
+                    "value": self.api_client.sanitize_for_serialization(template),
+                }
+            ],
+        )
+        generation = deployment.metadata.generation
+        if not deployment.spec.replicas:
+            return generation
+        if not self.wait_generation_observed(name, generation, TIMEOUT_SECONDS):
+            log.warning("Rollback not observed, not scaling: deployment={}".format(name))
+            return generation
+        self.appsV1Api.patch_namespaced_replica_set(
+            replica_set_name, self.namespace, {"spec": {"replicas": deployment.spec.replicas}}
+        )
+        return generation
+
+    def get_pod_template_hash(
+        self, deployment: client.V1Deployment, timeout: float = TIMEOUT_SECONDS
+    ) -> str:
+        """
+        pod-template-hash of the deployment's current ReplicaSet, or None if it can't be found.
+        """
+        replica_set = self.get_current_replica_set(deployment, timeout)
+        if replica_set is None:
+            return None
+        return (replica_set.metadata.labels or {}).get(POD_TEMPLATE_HASH_LABEL)
+
+    def verify_deployment_pods_current(
+        self, deployment: client.V1Deployment, timeout: float = TIMEOUT_SECONDS
+    ):
+        """
+        Wait until every pod selected by the deployment is from its current ReplicaSet and
+        none are terminating. Only the selector's matchLabels are used.
+        """
+        name = deployment.metadata.name
+        log.debug("Verifying pod terminations complete: deployment={}".format(name))
+        pod_template_hash = self.get_pod_template_hash(deployment, timeout)
+        terminated = self.get_informer(PODS).wait_until(
+            lambda pods: all(is_current_pod(pod, pod_template_hash) for pod in pods),
+            timeout,
+            labels=deployment.spec.selector.match_labels or {},
+        )
+        if not terminated:
+            raise Exception("Pod Termination Timeout Exceeded: deployment={}".format(name))
+        log.debug("Pod terminations complete: deployment={}".format(name))
+
+    def verify_pod_terminations_complete(self, app: str, timeout: float = TIMEOUT_SECONDS):
+        log.debug("Verifying pod terminations complete: app={}".format(app))
+        terminated = self.get_informer(PODS).wait_until(
+            lambda pods: all(pod.metadata.deletion_timestamp is None for pod in pods),
+            timeout,
+            labels={"app": app},
+        )
+        if not terminated:
             raise Exception("Pod Termination Timeout Exceeded: app={}".format(app))
         log.debug("Pod terminations complete: app={}".format(app))
 
     def verify_job_not_in_progress(self, job: str):
         log.debug("Verifying jobs not in progress: job={}".format(job))
-        result = self.coreV1Api.list_namespaced_pod(
-            self.namespace,
-            label_selector="app={}".format(job),
-            field_selector="status.phase!=Succeeded,status.phase!=Failed",
-        )
-        if len(result.items) > 0:
+        running = [
+            pod
+            for pod in self.get_informer(PODS).items(labels={"app": job})
+            if pod.status.phase not in FINISHED_POD_PHASES
+        ]
+        existing = self.get_informer(JOBS).get(job)
+        is_active = existing is not None and (existing.status.active or 0) > 0
+        if len(running) > 0 or is_active:
             raise Exception(
                 "Unable to perform migration. {} job already in progress".format(job)
             )
@@ -198,70 +621,177 @@ class KubeApi:
             return
         log.debug("Job deleted successfully: job={}".format(job))
 
-    def generate_app_migrator_job(self, tag: str, source: str):
+    def read_config_map(self, name: str) -> dict:
+        """
+        Data of a config map, or None when it doesn't exist.
+        """
+        try:
+            config_map = self.coreV1Api.read_namespaced_config_map(name, self.namespace)
+        except client.rest.ApiException as e:
+            if e.status != NOT_FOUND:
+                raise
+            return None
+        return config_map.data or {}
+
+    def write_config_map(self, name: str, data: dict):
+        config_map = client.V1ConfigMap(
+            metadata=client.V1ObjectMeta(name=name, namespace=self.namespace), data=data
+        )
+        try:
+            self.coreV1Api.replace_namespaced_config_map(name, self.namespace, config_map)
+        except client.rest.ApiException as e:
+            if e.status != NOT_FOUND:
+                raise
+            self.coreV1Api.create_namespaced_config_map(self.namespace, config_map)
+
+    def delete_config_map(self, name: str):
+        try:
+            self.coreV1Api.delete_namespaced_config_map(name, self.namespace)
+        except client.rest.ApiException as e:
+            if e.status != NOT_FOUND:
+                raise
+
+    def generate_app_migrator_job(self, tag: str, source: str) -> client.V1Job:
         log.debug("Generating app-migrator job: tag={} source={}".format(tag, source))
-        deployment = self.appsV1Api.read_namespaced_deployment(source, self.namespace)
+        deployment = copy.deepcopy(self.get_informer(DEPLOYMENTS).get(source))
+        if deployment is None:
+            deployment = self.appsV1Api.read_namespaced_deployment(source, self.namespace)
         metadata = client.V1ObjectMeta(
-            labels={"app": APP_MIGRATOR}, name=APP_MIGRATOR, namespace=self.namespace
-        )
-        new_image = generate_image(
-            old_image=deployment.spec.template.spec.containers[0].image, new_tag=tag
+            labels=dict(PROJECT_LABELS, app=APP_MIGRATOR),
+            name=APP_MIGRATOR,
+            namespace=self.namespace,
         )
+        pod_spec = deployment.spec.template.spec
+        new_images = retag_images(get_pod_spec_images(pod_spec), new_tag=tag)
+        for field, attribute in CONTAINER_FIELDS.items():
+            for container in getattr(pod_spec, attribute) or []:
+                container.image = new_images[field][container.name]
         job = client.V1Job(
             api_version="batch/v1",
             kind="Job",
             metadata=metadata,
             spec=client.V1JobSpec(
+                backoff_limit=0,
                 template=client.V1PodTemplateSpec(
                     spec=deployment.spec.template.spec, metadata=metadata
                 )
             ),
         )
-        job.spec.template.spec.containers[0].image = new_image
         job.spec.template.spec.restart_policy = "Never"
         job.spec.template.spec.containers[0].command = config.APP_MIGRATOR_COMMAND
         job.spec.template.spec.containers[0].args = config.APP_MIGRATOR_ARGS
         job.spec.template.spec.containers[0].resources = client.V1ResourceRequirements()
-
-        self.batchV1Api.create_namespaced_job(self.namespace, job)
         log.debug(
             "Generation of app-migrator job complete: tag={} source={}".format(
                 tag, source
             )
         )
+        return job
 
-    def verify_job_complete(self, job):
-        log.debug("Verifying job completion: job={}".format(job))
-        timeout_time = time.time() + TIMEOUT_SECONDS
-        active = True
-        succeeded = 0
-        failed = 0
+    def verify_job_complete(self, job: client.V1Job, log_handler=None):
+        """
+        Wait for a pod of the created job to succeed while streaming its logs, failing as soon
+        as it can't. Pods are matched by the job's uid, so pods of an earlier job with the same
+        name that are still being deleted are never mistaken for this run.
+        log_handler is called with the tail of the job logs once the job has finished or failed.
+        """
+        log.debug("Verifying job completion: job={}".format(job.metadata.name))
+        supervisor = JobSupervisor(
+            self.coreV1Api,
+            self.get_informer(PODS),
+            self.namespace,
+            job,
+            config.MIGRATION_LOG_LINES,
+        )
+        try:
+            supervisor.wait(TIMEOUT_SECONDS)
+        finally:
+            if log_handler is not None:
+                log_handler(supervisor.get_log_tail())
+        log.debug("Job completed successfully: job={}".format(job.metadata.name))
 
-        while time.time() < timeout_time and active:
-            log.debug("Checking job status: job={}".format(job))
-            result = self.batchV1Api.read_namespaced_job(job, self.namespace)
-            failed = (
-                0 if result.status.failed is None or result.status.failed == 0 else 1
-            )
-            succeeded = (
-                0
-                if result.status.succeeded is None or result.status.succeeded == 0
-                else 1
+    def prepull_images(self, images: List[str], image_pull_secrets: List[str] = ()):
+        """
+        Pull images on every node through a short-lived DaemonSet and remove it again,
+        authenticating with the deployments' image pull secrets.
+        """
+        log.debug("Pre-pulling images: images={}".format(images))
+        self.delete_prepull_daemon_sets()
+        daemon_set = self.appsV1Api.create_namespaced_daemon_set(
+            self.namespace, generate_prepull_daemon_set(images, image_pull_secrets)
+        )
+        try:
+            self.verify_images_pulled(daemon_set, len(images))
+        finally:
+            self.delete_prepull_daemon_sets()
+        log.debug("Pre-pulled images: images={}".format(images))
+
+    def delete_prepull_daemon_sets(self):
+        self.appsV1Api.delete_collection_namespaced_daemon_set(
+            self.namespace, label_selector="app={}".format(PREPULL_APP)
+        )
+
+    def verify_images_pulled(self, daemon_set: client.V1DaemonSet, image_count: int):
+        name = daemon_set.metadata.name
+        daemon_set_watcher = ResourceWatch(
+            self.appsV1Api.list_namespaced_daemon_set,
+            self.namespace,
+            POLL_WAIT,
+            field_selector="metadata.name={}".format(name),
+        )
+        observed = daemon_set_watcher.wait_until(
+            lambda items: len(items) > 0
+            and (items[0].status.observed_generation or 0) >= items[0].metadata.generation,
+            TIMEOUT_SECONDS,
+        )
+        if not observed:
+            raise Exception("Image Pre-pull Timeout Exceeded: daemon_set={}".format(name))
+        desired = daemon_set_watcher.items()[0].status.desired_number_scheduled
+
+        failures = []
+
+        def all_pulled(pods: list) -> bool:
+            failures.extend(
+                failure for failure in map(get_pull_failure, pods) if failure is not None
             )
-            active = failed == 0 and succeeded == 0
-            if active:
-                time.sleep(POLL_WAIT)
-        if active:
-            raise Exception("Job Termination Timeout Exceeded: job={}".format(job))
-        if failed > 0 or succeeded == 0:
-            raise Exception("Job Failed: job={}".format(job))
-        log.debug("Job completed successfully: job={}".format(job))
-
-    def run_migration(self, tag: str, source: str):
-        log.debug("Begin running migration: tag={} source={}".format(tag, source))
+            if len(failures) > 0:
+                return True
+            return len(pods) >= desired and all(is_pulled(pod, image_count) for pod in pods)
+
+        pulled = self.get_informer(PODS).wait_until(
+            all_pulled, TIMEOUT_SECONDS, labels=daemon_set.spec.selector.match_labels
+        )
+        if len(failures) > 0:
+            raise Exception("Image Pre-pull Failed:\n{}".format("\n".join(failures)))
+        if not pulled:
+            raise Exception("Image Pre-pull Timeout Exceeded: daemon_set={}".format(name))
+
+    def prepare_migration(self, tag: str, source: str) -> client.V1Job:
+        """
+        Clear out the previous migrator job and build the new one without creating it.
+        """
+        log.debug("Preparing migration: tag={} source={}".format(tag, source))
         self.verify_job_not_in_progress(APP_MIGRATOR)
         self.delete_job(APP_MIGRATOR)
         self.verify_pod_terminations_complete(APP_MIGRATOR)
-        self.generate_app_migrator_job(tag, source)
-        self.verify_job_complete(APP_MIGRATOR)
-        log.debug("Completed migration: tag={} source={}".format(tag, source))
+        job = self.generate_app_migrator_job(tag, source)
+        log.debug("Prepared migration: tag={} source={}".format(tag, source))
+        return job
+
+    def dry_run_migration(self, tag: str, source: str):
+        """
+        Check the migrator job against the api server. An existing job is fine, prepare_migration
+        removes it before the real run.
+        """
+        job = self.generate_app_migrator_job(tag, source)
+        try:
+            self.dry_run("POST", JOBS_PATH, job, "V1Job")
+        except client.rest.ApiException as e:
+            if e.status != ALREADY_EXISTS:
+                raise
+
+    def run_migration(self, job: client.V1Job, log_handler=None):
+        log.debug("Begin running migration: job={}".format(job.metadata.name))
+        created = self.batchV1Api.create_namespaced_job(self.namespace, job)
+        self.verify_job_complete(created, log_handler)
+        log.debug("Completed migration: job={}".format(job.metadata.name))
@@ -0,0 +1,102 @@
+import logging
+import time
+from kubernetes import client, watch
+from lib.tracing import tracer
+from lib.waitPolicy import Backoff
+
+log = logging.getLogger(__name__)
+GONE = 410
+WATCH_TIMEOUT_SECONDS = 60
+
+
+class WatchExpired(Exception):
+    """
+    The resourceVersion a watch was resumed from is no longer available.
+    """
+
+
+class ResourceWatch:
+    """
+    Local copy of a listed resource kept current by a resourceVersion-resumed watch
+    """
+
+    def __init__(self, list_func, namespace: str, poll_wait: float, **list_kwargs):
+        self.list_func = list_func
+        self.namespace = namespace
+        self.backoff = Backoff(maximum=poll_wait)
+        self.list_kwargs = list_kwargs
+        self.resource_version = None
+        self.objects = {}
+
+    def items(self) -> list:
+        return list(self.objects.values())
+
+    def relist(self):
+        response = self.list_func(self.namespace, **self.list_kwargs)
+        self.objects = {item.metadata.name: item for item in response.items}
+        self.resource_version = response.metadata.resource_version
+
+    def apply_event(self, event: dict):
+        if event["type"] == "ERROR":
+            status = event["raw_object"]
+            if status.get("code") == GONE:
+                raise WatchExpired(status.get("message"))
+            raise Exception("Watch Error: status={}".format(status))
+        item = event["object"]
+        self.resource_version = item.metadata.resource_version
+        if event["type"] == "DELETED":
+            self.objects.pop(item.metadata.name, None)
+        else:
+            self.objects[item.metadata.name] = item
+
+    def watch(self, timeout: float):
+        """
+        Yield after every change to the local copy until the server ends the watch.
+        """
+        stream = watch.Watch()
+        for event in stream.stream(
+            self.list_func,
+            self.namespace,
+            resource_version=self.resource_version,
+            timeout_seconds=max(1, int(min(timeout, WATCH_TIMEOUT_SECONDS))),
+            **self.list_kwargs,
+        ):
+            self.apply_event(event)
+            yield
+
+    def wait_until(self, condition, timeout: float) -> bool:
+        """
+        Block until condition(items) is true. Returns False if the timeout passes first.
+        """
+        timeout_time = time.time() + timeout
+        self.relist()
+        while not condition(self.items()):
+            remaining = timeout_time - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                for _ in self.watch(remaining):
+                    self.backoff.reset()
+                    if condition(self.items()) or time.time() >= timeout_time:
+                        break
+            except WatchExpired:
+                self.handle_expired()
+            except client.rest.ApiException as e:
+                if e.status == GONE:
+                    self.handle_expired()
+                elif e.status is not None and e.status < 500:
+                    raise
+                else:
+                    self.poll_fallback(e, timeout_time)
+            except Exception as e:
+                self.poll_fallback(e, timeout_time)
+        return True
+
+    def handle_expired(self):
+        log.debug("Watch expired, relisting: resource_version={}".format(self.resource_version))
+        self.relist()
+
+    def poll_fallback(self, error: Exception, timeout_time: float):
+        log.warning("Watch dropped, falling back to polling: error={}".format(str(error)))
+        tracer.sleep(min(self.backoff.next(), max(0, timeout_time - time.time())))
+        self.relist()
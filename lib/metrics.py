@@ -0,0 +1,179 @@
+import config
+import logging
+import requests
+
+log = logging.getLogger(__name__)
+
+ROLLOUT_STEPS = ["scale_down_deployment", "set_image", "scale_up_deployment"]
+ROLLOUT_BUCKETS = [5, 10, 30, 60, 120, 300, 600]
+PUSH_TIMEOUT_SECONDS = 10
+PUSH_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labels: dict) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in sorted(labels.items())
+        )
+    )
+
+
+class MetricsWriter:
+    """
+    Builds metrics in OpenMetrics or, for the pushgateway, the Prometheus 0.0.4 text format.
+    The two differ in counter family names (without / with _total) and the closing # EOF.
+    """
+
+    def __init__(self, openmetrics: bool = True):
+        self.openmetrics = openmetrics
+        self.lines = []
+
+    def add(self, name: str, metric_type: str, help_text: str, samples: list):
+        """
+        samples is a list of (suffix, labels, value).
+        """
+        family = name
+        if metric_type == "counter" and not self.openmetrics:
+            family = name + "_total"
+        self.lines.append("# HELP {} {}".format(family, help_text))
+        self.lines.append("# TYPE {} {}".format(family, metric_type))
+        for suffix, labels, value in samples:
+            self.lines.append("{}{}{} {}".format(name, suffix, format_labels(labels), value))
+
+    def add_histogram(self, name: str, help_text: str, values: dict, buckets: list):
+        """
+        values maps a label dict (as a tuple of items) to its observed values.
+        """
+        samples = []
+        for label_items, observed in values.items():
+            labels = dict(label_items)
+            for bucket in buckets + ["+Inf"]:
+                count = len(
+                    [value for value in observed if bucket == "+Inf" or value <= bucket]
+                )
+                samples.append(("_bucket", {**labels, "le": bucket}, count))
+            samples.append(("_sum", labels, round(sum(observed), 3)))
+            samples.append(("_count", labels, len(observed)))
+        self.add(name, "histogram", help_text, samples)
+
+    def render(self) -> str:
+        lines = self.lines + (["# EOF"] if self.openmetrics else [])
+        return "\n".join(lines) + "\n"
+
+
+def get_verb(api_method: str) -> str:
+    # AppsV1Api.patch_namespaced_deployment_scale -> patch
+    return api_method.split(".")[-1].split("_")[0]
+
+
+def build_metrics(report: dict, openmetrics: bool = True) -> str:
+    spans = report["spans"]
+    writer = MetricsWriter(openmetrics)
+
+    rollouts = {}
+    for span in spans:
+        if span["name"] in ROLLOUT_STEPS and span["seconds"] is not None:
+            rollouts.setdefault((("step", span["name"]),), []).append(span["seconds"])
+    writer.add_histogram(
+        "deploy_rollout_seconds",
+        "Per deployment rollout time, patch through verification.",
+        rollouts,
+        ROLLOUT_BUCKETS,
+    )
+
+    stages = {}
+    for span in spans:
+        if span["parent"] is None and span["seconds"] is not None:
+            stages[span["name"]] = stages.get(span["name"], 0) + span["seconds"]
+    writer.add(
+        "deploy_stage_seconds",
+        "gauge",
+        "Wall time spent in each deploy stage.",
+        [("", {"stage": stage}, round(seconds, 3)) for stage, seconds in stages.items()],
+    )
+
+    verbs = {}
+    for method, count in report["api_calls_by_method"].items():
+        verbs[get_verb(method)] = verbs.get(get_verb(method), 0) + count
+    writer.add(
+        "deploy_kubernetes_api_requests",
+        "counter",
+        "Kubernetes API requests by verb.",
+        [("_total", {"verb": verb}, count) for verb, count in verbs.items()],
+    )
+
+    slack_calls = report["slack_calls_by_method"]
+    writer.add(
+        "deploy_slack_requests",
+        "counter",
+        "Slack API requests by method.",
+        [("_total", {"method": method}, count) for method, count in slack_calls.items()],
+    )
+    writer.add(
+        "deploy_slack_request_seconds",
+        "summary",
+        "Slack API request latency.",
+        [
+            ("_sum", {}, report["slack_seconds"]),
+            ("_count", {}, sum(slack_calls.values())),
+        ],
+    )
+
+    migrations = [span["seconds"] for span in spans if span["name"] == "run_migration"]
+    writer.add(
+        "deploy_migration_seconds",
+        "gauge",
+        "Migration job duration.",
+        [("", {}, round(seconds or 0, 3)) for seconds in migrations[-1:]],
+    )
+
+    writer.add(
+        "deploy_wall_seconds",
+        "gauge",
+        "Total deploy wall time.",
+        [("", {}, report["wall_seconds"])],
+    )
+    writer.add(
+        "deploy_success",
+        "gauge",
+        "1 when the deploy succeeded.",
+        [("", {}, 1 if report.get("success") else 0)],
+    )
+    return writer.render()
+
+
+def export_metrics(report: dict):
+    """
+    Write metrics to METRICS_PATH and push them to PUSHGATEWAY_URL, whichever are configured.
+    Errors are logged, never raised.
+    """
+    if config.METRICS_PATH:
+        try:
+            with open(config.METRICS_PATH, "w") as metrics_file:
+                metrics_file.write(build_metrics(report))
+            log.debug("Wrote deploy metrics: path={}".format(config.METRICS_PATH))
+        except Exception as error:
+            log.error(
+                "Unable to write deploy metrics: path={} error={}".format(
+                    config.METRICS_PATH, error
+                )
+            )
+    if config.PUSHGATEWAY_URL:
+        url = "{}/metrics/job/kubernetes_deploy/project/{}/namespace/{}".format(
+            config.PUSHGATEWAY_URL.rstrip("/"), config.PROJECT, config.NAMESPACE
+        )
+        try:
+            response = requests.put(
+                url,
+                data=build_metrics(report, openmetrics=False).encode("utf-8"),
+                headers={"Content-Type": PUSH_CONTENT_TYPE},
+                timeout=PUSH_TIMEOUT_SECONDS,
+            )
+            if response.status_code >= 300:
+                raise ValueError("status={} body={}".format(response.status_code, response.text))
+            log.debug("Pushed deploy metrics: url={}".format(url))
+        except Exception as error:
+            log.error("Unable to push deploy metrics: url={} error={}".format(url, error))
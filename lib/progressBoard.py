@@ -0,0 +1,77 @@
+import time
+from threading import Event, Lock, Thread
+from typing import List
+from lib.slackApi import SlackApi
+
+PENDING = "pending"
+PATCHED = "patched"
+VERIFYING = "verifying"
+DONE = "done"
+FAILED = "failed"
+FINAL_STATES = [DONE, FAILED]
+
+
+class ProgressBoard:
+    """
+    Single Slack thread reply with every deployment's rollout state,
+    edited at most once per throttle window
+    """
+
+    def __init__(self, slacker: SlackApi, names: List[str], throttle_seconds: float):
+        self.slacker = slacker
+        self.throttle_seconds = throttle_seconds
+        now = time.time()
+        self.rows = {
+            name: {"stage": "", "state": PENDING, "started": now, "finished": None}
+            for name in names
+        }
+        self.lock = Lock()
+        self.dirty = False
+        self.stopped = Event()
+        self.slacker.send_board(self.render())
+        self.publisher = Thread(target=self.publish_changes, daemon=True)
+        self.publisher.start()
+
+    def set_state(self, name: str, state: str, stage: str = None):
+        with self.lock:
+            row = self.rows[name]
+            now = time.time()
+            if stage is not None and stage != row["stage"]:
+                row["stage"] = stage
+                row["started"] = now
+            row["state"] = state
+            row["finished"] = now if state in FINAL_STATES else None
+            self.dirty = True
+
+    def render(self) -> str:
+        now = time.time()
+        width = max([len(name) for name in self.rows] + [len("deployment")])
+        lines = ["{}  {:<12}{:<11}{}".format("deployment".ljust(width), "stage", "state", "time")]
+        for name, row in self.rows.items():
+            elapsed = (row["finished"] or now) - row["started"]
+            lines.append(
+                "{}  {:<12}{:<11}{:.0f}s".format(
+                    name.ljust(width), row["stage"], row["state"], elapsed
+                )
+            )
+        return "```\n{}\n```".format("\n".join(lines))
+
+    def publish(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            text = self.render()
+        self.slacker.update_board(text)
+
+    def publish_changes(self):
+        while not self.stopped.wait(self.throttle_seconds):
+            self.publish()
+
+    def close(self):
+        """
+        Stop the throttled edits and publish the final state.
+        """
+        self.stopped.set()
+        self.publisher.join()
+        self.publish()
@@ -0,0 +1,188 @@
+import config
+import logging
+import re
+import requests
+from threading import Lock
+from typing import List
+from lib.helpers import run_concurrently
+from lib.imageReference import (
+    ImageReference,
+    get_registry_host,
+    get_registry_repository,
+    parse_image,
+)
+
+log = logging.getLogger(__name__)
+
+UNAUTHORIZED = 401
+NOT_FOUND = 404
+REQUEST_TIMEOUT_SECONDS = 10
+GOOGLE_REGISTRY_SUFFIXES = ("gcr.io", "pkg.dev")
+MANIFEST_TYPES = ",".join(
+    [
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.oci.image.manifest.v1+json",
+    ]
+)
+
+digest_cache = {}
+digest_locks = {}
+digest_locks_lock = Lock()
+auth_headers_cache = {}
+auth_headers_lock = Lock()
+challenge_tokens = {}
+
+
+def get_registry_url(host: str) -> str:
+    scheme = "http" if host in config.INSECURE_REGISTRIES else "https"
+    return "{}://{}/v2".format(scheme, host)
+
+
+def get_auth_headers(host: str, repository: str) -> dict:
+    """
+    Authorization for a registry repository: a token from the registry's bearer challenge
+    once one was answered, otherwise the host's static authorization fetched once per run.
+    """
+    with auth_headers_lock:
+        token = challenge_tokens.get((host, repository))
+        if token is not None:
+            return {"Authorization": "Bearer {}".format(token)}
+        if host not in auth_headers_cache:
+            auth_headers_cache[host] = fetch_auth_headers(host)
+        return auth_headers_cache[host]
+
+
+def fetch_auth_headers(host: str) -> dict:
+    if config.REGISTRY_TOKEN:
+        return {"Authorization": "Bearer {}".format(config.REGISTRY_TOKEN)}
+    if host.endswith(GOOGLE_REGISTRY_SUFFIXES):
+        import google.auth
+        import google.auth.transport.requests
+
+        credentials, _ = google.auth.default(
+            scopes=["https://www.googleapis.com/auth/cloud-platform"]
+        )
+        credentials.refresh(google.auth.transport.requests.Request())
+        return {"Authorization": "Bearer {}".format(credentials.token)}
+    return {}
+
+
+def parse_auth_challenge(header: str) -> dict:
+    """
+    Parameters of a `Bearer realm="...",service="...",scope="..."` WWW-Authenticate header,
+    None for any other scheme.
+    """
+    scheme, _, params = header.strip().partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    challenge = dict(re.findall(r'(\w+)="([^"]*)"', params))
+    return challenge if "realm" in challenge else None
+
+
+def fetch_challenge_token(challenge: dict, repository: str) -> str:
+    """
+    Pull token from the realm of a registry's bearer challenge (Docker Hub, GHCR, Quay,
+    Harbor), anonymous unless REGISTRY_USERNAME is set.
+    """
+    params = {
+        "service": challenge.get("service"),
+        "scope": challenge.get("scope") or "repository:{}:pull".format(repository),
+    }
+    auth = None
+    if config.REGISTRY_USERNAME:
+        auth = (config.REGISTRY_USERNAME, config.REGISTRY_PASSWORD or "")
+    log.debug("Fetching registry token: realm={}".format(challenge["realm"]))
+    response = requests.get(
+        challenge["realm"],
+        params={key: value for key, value in params.items() if value},
+        auth=auth,
+        timeout=REQUEST_TIMEOUT_SECONDS,
+    )
+    if response.status_code != 200:
+        raise ValueError(
+            "Something went wrong fetching a registry token: realm={} status={}".format(
+                challenge["realm"], response.status_code
+            )
+        )
+    body = response.json()
+    token = body.get("token") or body.get("access_token")
+    if not token:
+        raise ValueError("Registry returned no token: realm={}".format(challenge["realm"]))
+    return token
+
+
+def head_manifest(host: str, repository: str, url: str):
+    """
+    HEAD a manifest, answering the registry's bearer challenge once if it asks for a token.
+    """
+    headers = {"Accept": MANIFEST_TYPES, **get_auth_headers(host, repository)}
+    response = requests.head(url, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS)
+    if response.status_code != UNAUTHORIZED:
+        return response
+    challenge = parse_auth_challenge(response.headers.get("WWW-Authenticate", ""))
+    if challenge is None:
+        return response
+    token = fetch_challenge_token(challenge, repository)
+    with auth_headers_lock:
+        challenge_tokens[(host, repository)] = token
+    headers = {"Accept": MANIFEST_TYPES, **get_auth_headers(host, repository)}
+    return requests.head(url, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS)
+
+
+def fetch_manifest_digest(reference: ImageReference) -> str:
+    """
+    HEAD the manifest of a tag and return its content digest, or None when the tag doesn't exist.
+    """
+    host = get_registry_host(reference)
+    repository = get_registry_repository(reference)
+    url = "{}/{}/manifests/{}".format(get_registry_url(host), repository, reference.tag)
+    log.debug("Resolving image manifest: url={}".format(url))
+    response = head_manifest(host, repository, url)
+    if response.status_code == NOT_FOUND:
+        return None
+    if response.status_code != 200:
+        raise ValueError(
+            "Something went wrong resolving image {}: status={}".format(
+                reference, response.status_code
+            )
+        )
+    digest = response.headers.get("Docker-Content-Digest")
+    if digest is None:
+        raise ValueError("Registry returned no digest for image {}".format(reference))
+    return digest
+
+
+def get_manifest_digest(reference: ImageReference) -> str:
+    """
+    Manifest digest of repository:tag, resolved once per repository and tag for the whole run.
+    """
+    key = (reference.name, reference.tag)
+    with digest_locks_lock:
+        lock = digest_locks.setdefault(key, Lock())
+    with lock:
+        if key not in digest_cache:
+            digest_cache[key] = fetch_manifest_digest(reference)
+        return digest_cache[key]
+
+
+def find_missing_images(images: List[str], max_workers: int) -> List[str]:
+    """
+    Images whose tag has no manifest in its registry, checked concurrently.
+    Raises when a registry can't be asked, so a deploy never starts on an unknown answer.
+    """
+    missing = []
+
+    def check(image: str):
+        if get_manifest_digest(parse_image(image)) is None:
+            missing.append(image)
+
+    failures = run_concurrently(check, images, max_workers)
+    if len(failures) > 0:
+        raise Exception(
+            "Unable To Resolve Images:\n{}".format(
+                "\n".join("image={} error={}".format(image, error) for image, error in failures)
+            )
+        )
+    return sorted(missing)
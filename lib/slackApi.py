@@ -1,6 +1,12 @@
 import config
 import logging
+import time
+from queue import Empty, Queue
+from threading import Thread
+from typing import List, NamedTuple
 from slackclient import SlackClient
+from lib.imageMap import describe_images
+from lib.tracing import tracer
 
 log = logging.getLogger(__name__)
 
@@ -11,6 +17,28 @@ BASE_LOG_URL = (
 )
 
 MIGRATION_TEXT_MAP = ["None", ":hotsprings: Hot", ":snowflake: Cold"]
+POST_MESSAGE = "chat.postMessage"
+UPDATE_MESSAGE = "chat.update"
+UPLOAD_FILE = "files.upload"
+RATE_LIMITED = "ratelimited"
+MAX_RATE_LIMIT_RETRIES = 3
+MAX_TEXT_LENGTH = 3000
+
+
+class SlackMessage(NamedTuple):
+    method: str
+    is_reply: bool
+    is_board: bool
+    kwargs: dict
+
+
+def is_coalescable(message: SlackMessage) -> bool:
+    return (
+        message.method == POST_MESSAGE
+        and message.is_reply
+        and not message.is_board
+        and list(message.kwargs.keys()) == ["text"]
+    )
 
 
 class SlackApi:
@@ -27,36 +55,135 @@ class SlackApi:
         self.username = f"{config.PROJECT.title()} {self.cluster_text} Deployer"
         self.migration_text = MIGRATION_TEXT_MAP[config.MIGRATION_LEVEL]
         self.thread_ts = 0
+        self.board_ts = None
+        self.board_channel = None
+        self.queue = Queue(maxsize=config.SLACK_QUEUE_SIZE)
+        self.sender = Thread(target=self.process_queue, daemon=True)
+        self.sender.start()
 
     def send_message(self, **kwargs):
         """
-        Sends message to Slack
+        Queues message for the background sender
         """
-        try:
-            log.debug(
-                "Sending to Slack #{}: text={}".format(
-                    config.SLACK_CHANNEL, kwargs.get("text")
+        self.queue.put(SlackMessage(POST_MESSAGE, False, False, kwargs))
+
+    def send_thread_reply(self, text, **kwargs):
+        """
+        Queues message for the Slack thread, replies sent close together are posted as one
+        """
+        self.queue.put(SlackMessage(POST_MESSAGE, True, False, dict(text=text, **kwargs)))
+
+    def send_board(self, text):
+        """
+        Queues the thread reply that later update_board calls edit in place
+        """
+        self.queue.put(SlackMessage(POST_MESSAGE, True, True, {"text": text}))
+
+    def update_board(self, text):
+        self.queue.put(SlackMessage(UPDATE_MESSAGE, False, True, {"text": text}))
+
+    def send_thread_snippet(self, title: str, content: str):
+        """
+        Queues a text snippet upload to the Slack thread
+        """
+        self.queue.put(
+            SlackMessage(UPLOAD_FILE, True, False, {"title": title, "content": content})
+        )
+
+    def flush(self):
+        """
+        Blocks until every queued message has been sent
+        """
+        self.queue.join()
+
+    def process_queue(self):
+        pending = None
+        while True:
+            batch = [pending or self.queue.get()]
+            pending = None
+            if is_coalescable(batch[0]):
+                deadline = time.time() + config.SLACK_COALESCE_SECONDS
+                length = len(batch[0].kwargs["text"])
+                while time.time() < deadline:
+                    try:
+                        message = self.queue.get(timeout=deadline - time.time())
+                    except Empty:
+                        break
+                    length += len(message.kwargs["text"]) if is_coalescable(message) else 0
+                    if not is_coalescable(message) or length > MAX_TEXT_LENGTH:
+                        pending = message
+                        break
+                    batch.append(message)
+            message = batch[0]
+            if len(batch) > 1:
+                text = "\n\n".join(message.kwargs["text"] for message in batch)
+                message = message._replace(kwargs={"text": text})
+            self.send_queued_message(message)
+            for _ in batch:
+                self.queue.task_done()
+
+    def send_queued_message(self, message: SlackMessage):
+        if message.method == UPDATE_MESSAGE:
+            if self.board_ts is not None:
+                self.call_api(
+                    UPDATE_MESSAGE, channel=self.board_channel, ts=self.board_ts, **message.kwargs
                 )
+            return
+        if message.method == UPLOAD_FILE:
+            self.call_api(
+                UPLOAD_FILE,
+                channels=config.SLACK_CHANNEL,
+                thread_ts=self.thread_ts,
+                filetype="text",
+                **message.kwargs,
             )
-            returned = self.slacker.api_call(
-                "chat.postMessage",
-                channel=config.SLACK_CHANNEL,
-                username=self.username,
-                icon_emoji=self.icon,
-                **kwargs,
-            )
-            log.debug("Returned from Slack: {}".format(returned))
+            return
+        kwargs = message.kwargs
+        if message.is_reply:
+            kwargs = dict(thread_ts=self.thread_ts, **kwargs)
+        returned = self.post_message(**kwargs)
+        if message.is_board:
+            self.board_ts = returned.get("ts")
+            self.board_channel = returned.get("channel")
+        elif not message.is_reply:
             self.thread_ts = returned.get("ts")
-        except Exception as error:
-            log.error(error)
 
-    def send_thread_reply(self, text, **kwargs):
+    def post_message(self, **kwargs) -> dict:
         """
-        Sends message to Slack thread
+        Sends message to Slack
         """
-        self.send_message(thread_ts=self.thread_ts, text=text, **kwargs)
+        log.debug(
+            "Sending to Slack #{}: text={}".format(config.SLACK_CHANNEL, kwargs.get("text"))
+        )
+        return self.call_api(
+            POST_MESSAGE,
+            channel=config.SLACK_CHANNEL,
+            username=self.username,
+            icon_emoji=self.icon,
+            **kwargs,
+        )
 
-    def send_initial_message(self):
+    def call_api(self, method: str, **kwargs) -> dict:
+        """
+        Calls the Slack api, waiting out rate limits. Errors are logged, not raised.
+        """
+        returned = {}
+        try:
+            for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+                start = time.time()
+                returned = self.slacker.api_call(method, **kwargs)
+                tracer.record_slack_call(method, time.time() - start)
+                if returned.get("error") != RATE_LIMITED:
+                    break
+                retry_after = int(returned.get("headers", {}).get("Retry-After", 1))
+                log.warning("Slack rate limited: retry_after={}".format(retry_after))
+                time.sleep(retry_after)
+            log.debug("Returned from Slack: {}".format(returned))
+        except Exception as error:
+            log.error(error)
+        return returned
+
+    def send_initial_message(self, waves: List[List[str]] = None):
         text = "{} Deployment Processing".format(self.cluster_text)
         attachments = [
             {
@@ -80,6 +207,17 @@ class SlackApi:
                 ],
             }
         ]
+        if waves is not None:
+            attachments[0]["fields"].append(
+                {
+                    "title": "Targets",
+                    "value": "\n".join(
+                        "wave {}: {}".format(index + 1, ", ".join(targets))
+                        for index, targets in enumerate(waves)
+                    ),
+                    "short": False,
+                }
+            )
 
         self.send_message(text=text, attachments=attachments)
 
@@ -89,6 +227,7 @@ class SlackApi:
         error_handling_message: str = None,
         deployments: list = [],
         requires_migration_rollback: bool = False,
+        report_summary: str = None,
     ):
         has_error = error_message is not None
 
@@ -155,8 +294,8 @@ class SlackApi:
                         attachments[-1]["fields"].append(
                             {
                                 "title": "Requires Image Rollback",
-                                "value": "Desired Image: {}".format(
-                                    deployment["image"]
+                                "value": "Desired Images:\n{}".format(
+                                    describe_images(deployment["images"])
                                 ),
                                 "short": False,
                             }
@@ -174,6 +313,11 @@ class SlackApi:
                 }
             ]
 
+        if report_summary is not None:
+            attachments[0]["fields"].append(
+                {"title": "Timings", "value": "```{}```".format(report_summary), "short": False}
+            )
+
         attachments[0]["actions"] = [
             {
                 "type": "button",
@@ -185,3 +329,23 @@ class SlackApi:
         ]
 
         self.send_thread_reply(text, attachments=attachments, reply_broadcast=True)
+
+
+class TargetSlacker:
+    """
+    SlackApi view for one deploy target, prefixing its thread replies with the target name
+    so every target of a fan-out deploy can share one thread
+    """
+
+    def __init__(self, slacker: SlackApi, target: str):
+        self.slacker = slacker
+        self.target = target
+
+    def send_thread_reply(self, text, **kwargs):
+        self.slacker.send_thread_reply("[{}] {}".format(self.target, text), **kwargs)
+
+    def send_thread_snippet(self, title: str, content: str):
+        self.slacker.send_thread_snippet("[{}] {}".format(self.target, title), content)
+
+    def __getattr__(self, name: str):
+        return getattr(self.slacker, name)
@@ -0,0 +1,105 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, NamedTuple
+from lib.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+
+class GraphStep(NamedTuple):
+    """
+    Deploy step that runs once every input has been produced by another step
+    """
+
+    name: str
+    func: Callable
+    inputs: List[str]
+    outputs: List[str]
+    rollback: Callable
+
+
+class StepGraph:
+    """
+    Runs steps as soon as their inputs are available, independent steps at the same time.
+    On failure nothing new is started, and once running steps finish the rollback handlers
+    of completed steps (and the failed ones) run in reverse completion order, which is a
+    reverse topological order.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.steps = []
+        self.finished = []
+
+    def add(
+        self,
+        name: str,
+        func: Callable,
+        inputs: List[str] = (),
+        outputs: List[str] = (),
+        rollback: Callable = None,
+    ):
+        self.steps.append(GraphStep(name, func, list(inputs), list(outputs), rollback))
+
+    def get_dependencies(self, step: GraphStep) -> List[str]:
+        return [
+            other.name
+            for other in self.steps
+            if any(output in step.inputs for output in other.outputs)
+        ]
+
+    def validate(self):
+        outputs = {output for step in self.steps for output in step.outputs}
+        for step in self.steps:
+            missing = [name for name in step.inputs if name not in outputs]
+            if len(missing) > 0:
+                raise ValueError(
+                    "Step inputs aren't produced by any step: step={} inputs={}".format(
+                        step.name, ",".join(missing)
+                    )
+                )
+
+    def run(self):
+        """
+        Run every step. Raises the first step error after the running steps have finished.
+        """
+        self.validate()
+        produced = set()
+        pending = list(self.steps)
+        running = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                if len(errors) == 0:
+                    for step in [s for s in pending if set(s.inputs) <= produced]:
+                        pending.remove(step)
+                        running[executor.submit(tracer.bind(step.func))] = step
+                if len(running) == 0:
+                    break
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    self.finished.append(step)
+                    error = future.exception()
+                    if error is not None:
+                        log.error("Step failed: step={} error={}".format(step.name, error))
+                        errors.append(error)
+                    else:
+                        produced.update(step.outputs)
+        if len(errors) > 0:
+            raise errors[0]
+        if len(pending) > 0:
+            raise ValueError(
+                "Steps never became ready: steps={}".format(
+                    ",".join(step.name for step in pending)
+                )
+            )
+
+    def rollback(self):
+        """
+        Run the rollback handler of every step that ran, the last finished first.
+        """
+        for step in reversed(self.finished):
+            if step.rollback is not None:
+                log.debug("Rolling back step: step={}".format(step.name))
+                step.rollback()
@@ -0,0 +1,211 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+
+log = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    Timed section of the deploy with the API calls and sleeps made inside it
+    """
+
+    def __init__(self, span_id: int, name: str, parent, offset: float, attributes: dict):
+        self.span_id = span_id
+        self.name = name
+        self.parent = parent
+        self.offset = offset
+        self.attributes = attributes
+        self.seconds = None
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self.sleep_seconds = 0.0
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.span_id,
+            "name": self.name,
+            "parent": self.parent.span_id if self.parent is not None else None,
+            "attributes": self.attributes,
+            "offset_seconds": round(self.offset, 3),
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "api_calls": self.api_calls,
+            "api_seconds": round(self.api_seconds, 3),
+            "sleep_seconds": round(self.sleep_seconds, 3),
+            "error": self.error,
+        }
+
+
+class InstrumentedApi:
+    """
+    Proxy for a kubernetes api object that records every method call with the tracer
+    """
+
+    def __init__(self, api, tracer: "Tracer"):
+        self.api = api
+        self.tracer = tracer
+        self.api_name = type(api).__name__
+
+    def __getattr__(self, attribute):
+        value = getattr(self.api, attribute)
+        if not callable(value):
+            return value
+
+        @wraps(value)
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self.tracer.record_api_call(
+                    "{}.{}".format(self.api_name, attribute), time.time() - start
+                )
+
+        return call
+
+
+class Tracer:
+    """
+    Collects spans, API call counts and sleep time for the deploy report
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+        self.api_calls = {}
+        self.api_seconds = 0.0
+        self.sleep_seconds = 0.0
+        self.slack_calls = {}
+        self.slack_seconds = 0.0
+        self.lock = Lock()
+        self.local = local()
+
+    def stack(self) -> list:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        stack = self.stack()
+        with self.lock:
+            span = Span(
+                len(self.spans),
+                name,
+                stack[-1] if len(stack) > 0 else None,
+                time.time() - self.started,
+                attributes,
+            )
+            self.spans.append(span)
+        stack.append(span)
+        start = time.time()
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            span.seconds = time.time() - start
+            stack.pop()
+
+    def traced(self, func):
+        """
+        Decorator running every call of func in a span named after it.
+        """
+
+        @wraps(func)
+        def traced_func(*args, **kwargs):
+            with self.span(func.__name__):
+                return func(*args, **kwargs)
+
+        return traced_func
+
+    def bind(self, func):
+        """
+        Wrap func so calls from other threads are recorded under the spans active right now.
+        """
+        stack = list(self.stack())
+
+        @wraps(func)
+        def bound(*args, **kwargs):
+            self.local.stack = list(stack)
+            return func(*args, **kwargs)
+
+        return bound
+
+    def instrument(self, api) -> InstrumentedApi:
+        return InstrumentedApi(api, self)
+
+    def record_api_call(self, name: str, seconds: float):
+        with self.lock:
+            self.api_calls[name] = self.api_calls.get(name, 0) + 1
+            self.api_seconds += seconds
+            for span in self.stack():
+                span.api_calls += 1
+                span.api_seconds += seconds
+
+    def record_slack_call(self, method: str, seconds: float):
+        with self.lock:
+            self.slack_calls[method] = self.slack_calls.get(method, 0) + 1
+            self.slack_seconds += seconds
+
+    def sleep(self, seconds: float):
+        """
+        time.sleep that is counted as sleep time for the active spans.
+        """
+        time.sleep(seconds)
+        with self.lock:
+            self.sleep_seconds += seconds
+            for span in self.stack():
+                span.sleep_seconds += seconds
+
+    def get_report(self, **fields) -> dict:
+        with self.lock:
+            return {
+                **fields,
+                "wall_seconds": round(time.time() - self.started, 3),
+                "api_calls": sum(self.api_calls.values()),
+                "api_seconds": round(self.api_seconds, 3),
+                "api_calls_by_method": dict(self.api_calls),
+                "sleep_seconds": round(self.sleep_seconds, 3),
+                "slack_calls_by_method": dict(self.slack_calls),
+                "slack_seconds": round(self.slack_seconds, 3),
+                "spans": [span.to_dict() for span in self.spans],
+            }
+
+    def write_report(self, path: str, **fields) -> dict:
+        report = self.get_report(**fields)
+        try:
+            with open(path, "w") as report_file:
+                json.dump(report, report_file, indent=2)
+            log.debug("Wrote deploy report: path={}".format(path))
+        except Exception as error:
+            log.error("Unable to write deploy report: path={} error={}".format(path, error))
+        return report
+
+
+def summarize_report(report: dict) -> str:
+    """
+    Top level step timings and totals for the Slack completion message.
+    """
+    lines = [
+        "{} {:.1f}s".format(span["name"], span["seconds"] or 0)
+        for span in report["spans"]
+        if span["parent"] is None
+    ]
+    lines.append(
+        "wall={:.1f}s api_calls={} api_time={:.1f}s sleep_time={:.1f}s".format(
+            report["wall_seconds"],
+            report["api_calls"],
+            report["api_seconds"],
+            report["sleep_seconds"],
+        )
+    )
+    return "\n".join(lines)
+
+
+tracer = Tracer()
@@ -0,0 +1,102 @@
+import config
+import math
+import random
+
+# annotations read from (and for history, written to) each deployment
+TIMEOUT_ANNOTATION = "kubernetes-deploy/timeout-seconds"
+TERMINATION_TIMEOUT_ANNOTATION = "kubernetes-deploy/termination-timeout-seconds"
+ROLLOUT_SECONDS_ANNOTATION = "kubernetes-deploy/rollout-seconds"
+DEFAULT_PROGRESS_DEADLINE_SECONDS = 600
+DEFAULT_TERMINATION_GRACE_SECONDS = 30
+DEFAULT_MAX_SURGE = "25%"
+DEFAULT_MAX_UNAVAILABLE = "25%"
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter, starting sub-second and capped at maximum
+    """
+
+    def __init__(
+        self, maximum: float, initial: float = 0.5, factor: float = 2, jitter: float = 0.2
+    ):
+        self.maximum = maximum
+        self.initial = initial
+        self.factor = factor
+        self.jitter = jitter
+        self.current = initial
+
+    def next(self) -> float:
+        delay = self.current * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.current = min(self.current * self.factor, self.maximum)
+        return min(delay, self.maximum)
+
+    def reset(self):
+        self.current = self.initial
+
+
+def resolve_int_or_percent(value, total: int, round_up: bool) -> int:
+    """
+    Resolve a rolling update maxSurge / maxUnavailable the way the deployment controller does.
+    """
+    if isinstance(value, int):
+        return value
+    percent = int(str(value).rstrip("%")) * total / 100
+    return math.ceil(percent) if round_up else math.floor(percent)
+
+
+def get_rollout_batches(deployment: dict) -> int:
+    """
+    Number of surge steps the controller needs to replace every pod.
+    """
+    rollout = deployment["rollout"]
+    replicas = max(deployment["replicas"] or 0, 1)
+    if rollout["strategy"] != "RollingUpdate":
+        return 1
+    max_surge = resolve_int_or_percent(
+        rollout["max_surge"] or DEFAULT_MAX_SURGE, replicas, round_up=True
+    )
+    max_unavailable = resolve_int_or_percent(
+        rollout["max_unavailable"] or DEFAULT_MAX_UNAVAILABLE, replicas, round_up=False
+    )
+    return math.ceil(replicas / max(max_surge + max_unavailable, 1))
+
+
+def get_annotation_seconds(deployment: dict, annotation: str) -> float:
+    value = deployment["annotations"].get(annotation)
+    return float(value) if value else None
+
+
+def get_rollout_timeout(deployment: dict) -> float:
+    """
+    Deadline for a deployment's pods to update: the timeout annotation when set, otherwise
+    enough surge batches for its replica count, at least progressDeadlineSeconds and twice the
+    last recorded rollout.
+    """
+    override = get_annotation_seconds(deployment, TIMEOUT_ANNOTATION)
+    if override is not None:
+        return override
+    progress_deadline = (
+        deployment["rollout"]["progress_deadline_seconds"] or DEFAULT_PROGRESS_DEADLINE_SECONDS
+    )
+    history = get_annotation_seconds(deployment, ROLLOUT_SECONDS_ANNOTATION) or 0
+    return max(
+        config.MIN_ROLLOUT_TIMEOUT_SECONDS,
+        get_rollout_batches(deployment) * config.ROLLOUT_BATCH_SECONDS,
+        progress_deadline,
+        history * config.ROLLOUT_HISTORY_FACTOR,
+    )
+
+
+def get_termination_timeout(deployment: dict) -> float:
+    """
+    Deadline for a deployment's old pods to go away: the termination timeout annotation when set,
+    otherwise the pods' termination grace period plus a margin.
+    """
+    override = get_annotation_seconds(deployment, TERMINATION_TIMEOUT_ANNOTATION)
+    if override is not None:
+        return override
+    grace = deployment["rollout"]["termination_grace_seconds"]
+    if grace is None:
+        grace = DEFAULT_TERMINATION_GRACE_SECONDS
+    return grace + config.TERMINATION_MARGIN_SECONDS